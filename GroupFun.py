@@ -3,6 +3,23 @@ import plugins
 import sqlite3
 from datetime import datetime, timedelta
 import os
+import atexit
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from .achievements import ProgressCache, load_achievements
+from .analytics import ActivityAnalytics
+from .compactor import Compactor
+from .leaderboard import LeaderboardCache, ReplyCache
+from .memes import MEME_THRESHOLD, MemeTracker, content_hash, is_potential_meme, meme_key
+from .metrics import Metrics, PeriodicReporter
+from .partitions import month_of
+from .profiles import ProfileCache
+from .relay import WriteRelay, load_token
+from .schema import migrate
+from .shards import ShardRouter
+from .storage import ContentStore
+from .writer import PartialFlushError, WriteBehindQueue
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_message import ChatMessage
@@ -10,6 +27,33 @@ from common.log import logger
 from plugins import *
 from collections import defaultdict
 
+# 入队的消息快照，字段名沿用 ChatMessage 的属性名；时间在收到消息时确定
+MessageRecord = namedtuple("MessageRecord", [
+    "other_user_id", "actual_user_id", "actual_user_nickname", "content", "create_time", "hour", "date",
+    "meme_key",
+])
+
+# 查询命令（按前缀匹配，顺序即匹配顺序）；插件状态仅限配置的 admin_users 使用
+COMMANDS = ("今日水王", "本周水王", "本月水王", "梗百科", "梗排行榜", "我的成就", "活跃热力图", "高峰时段", "我的活跃时段",
+            "插件状态")
+
+def period_range(period, date=None):
+    """统计周期的日期区间[start, end)，周从周一开始；create_time 可直接与之做字符串比较"""
+    day = datetime.strptime(date, '%Y-%m-%d') if date else datetime.now()
+    day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "day":
+        start = day
+        end = day + timedelta(days=1)
+    elif period == "week":
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    elif period == "month":
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f"无效的时间范围: {period}")
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
 @plugins.register(
     name="GroupFun",
     desire_priority=89,
@@ -27,20 +71,66 @@ class GroupFun(Plugin):
         os.makedirs(self.curdir, exist_ok=True)
         self.db_path = os.path.join(self.curdir, "fun_center.db")
         
-        # 成就配置
-        self.ACHIEVEMENTS = {
-            "meme_lord": {"name": "🤪梗王", "condition": 10, "desc": "原创梗被引用10次以上"},
-            "water_king": {"name": "🏆水王", "condition": 50, "desc": "单日发言超过50条"},
-            "night_owl": {"name": "🌙夜猫子", "condition": 3, "desc": "凌晨0-5点发言3次"},
-            "early_bird": {"name": "🐦早起鸟", "condition": 3, "desc": "早上6-8点发言3次"}
-        }
-        
         try:
             self.config = super().load_config()
             if not self.config:
                 self.config = self._load_config_template()
             self.max_record_days = self.config.get("max_record_days", 30)  # 默认保留30天
-            self.init_database()
+            self.water_king_top_n = self.config.get("water_king_top_n", 3)
+            self.admin_users = set(self.config.get("admin_users") or [])
+            metrics_conf = self.config.get("metrics") or {}
+            self.metrics = Metrics(metrics_conf.get("slow_ms", 200))
+            # 成就规则来自配置的 achievements，未配置时使用默认的四个成就
+            self.ACHIEVEMENTS = load_achievements(self.config)
+            # 按 group_id 分到 shards 个库文件；按月分区时聊天记录写入各分片的 chat_partitions/chat_YYYYMM.db
+            read_path = self.config.get("read_path") or {}
+            self.shards = ShardRouter(
+                self.db_path,
+                self.config.get("shards", 1),
+                self.config.get("db_pragmas"),
+                partition_by_month=self.config.get("partition_by_month", False),
+                achievements=self.ACHIEVEMENTS,
+                read_pool_size=read_path.get("pool_size", 4),
+            )
+            single_writer = self.config.get("single_writer") or {}
+            self.leaderboard = LeaderboardCache(
+                self._load_period_counts,
+                lambda group_id: self.shards.db(group_id).reader(),
+                max_age=single_writer.get("cache_seconds", 5) if single_writer.get("enabled", False) else None,
+            )
+            # 梗榜和活跃时段统计的回复最多使用 max_staleness_seconds 秒，查询风暴时不反复聚合
+            self.replies = ReplyCache(read_path.get("max_staleness_seconds", 5))
+            self.memes = MemeTracker(self.config.get("meme_cache_size", 5000),
+                                     self.config.get("meme_fuzzy_distance", 0))
+            # 群成员当前昵称，昵称变化时才写库
+            self.profiles = ProfileCache(self.config.get("profile_cache_size", 10000))
+            self.progress_cache = ProgressCache(self.config.get("achievement_cache_ttl", 30))
+            # 紧凑存储：正文和昵称去重存放，长的非梗消息截断
+            compact = self.config.get("compact_storage") or {}
+            self.content_store = ContentStore(compact.get("max_content_length", 50)) \
+                if compact.get("enabled", False) else None
+            self.analytics = ActivityAnalytics(self.shards, self.config.get("analytics_days", self.max_record_days))
+            # 建表/迁移在后台线程进行，完成前收到的消息先缓存在内存（写入队列或 _pending）中
+            self.db_ready = threading.Event()
+            self.init_error = None
+            self._stop = threading.Event()
+            self._pending_lock = threading.Lock()
+            write_queue = self.config.get("write_queue") or {}
+            self._pending = deque()
+            # 与写入队列共用容量和溢出策略；就绪前没有消费者，block 等待无意义，按 drop_new 处理
+            self._pending_max = write_queue.get("max_size", 10000)
+            self._pending_overflow = write_queue.get("overflow", "drop_old")
+            self._pending_dropped = 0
+            self._compactors_started = False
+            self.relay = None
+            self.writer = self._create_writer(write_queue)
+            # 写入队列就绪后再监听转发端口
+            self.relay = self._create_relay(single_writer)
+            self.compactors = self._create_compactors(self.config.get("retention") or {})
+            self.reporter = self._create_reporter(metrics_conf)
+            self._init_thread = threading.Thread(target=self._init_storage, name="GroupFun-init", daemon=True)
+            self._init_thread.start()
+            atexit.register(self.close)
             logger.info("[GroupFun] inited")
             
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
@@ -50,78 +140,156 @@ class GroupFun(Plugin):
             raise RuntimeError("[GroupFun] init failed, ignore") from e
 
     def init_database(self):
-        """初始化数据库"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("PRAGMA journal_mode=WAL")
-                cursor = conn.cursor()
-                
-                # 聊天记录表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS chat_records (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        group_id TEXT NOT NULL,
-                        user_nickname TEXT NOT NULL,
-                        user_id TEXT NOT NULL,
-                        content TEXT,
-                        create_time TEXT NOT NULL,
-                        hour_group INTEGER
-                    )''')
-                
-                # 梗词典表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS meme_dict (
-                        group_id TEXT NOT NULL,
-                        meme_text TEXT NOT NULL,
-                        creator TEXT NOT NULL,
-                        creator_id TEXT NOT NULL,
-                        usage_count INTEGER DEFAULT 1,
-                        create_time TEXT NOT NULL,
-                        PRIMARY KEY (group_id, meme_text)
-                    )''')
-                
-                # 用户梗数统计表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS user_meme_stats (
-                        user_id TEXT NOT NULL,
-                        group_id TEXT NOT NULL,
-                        meme_count INTEGER DEFAULT 0,
-                        PRIMARY KEY (user_id, group_id)
-                    )''')
-                
-                # 成就表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS user_achievements (
-                        user_id TEXT NOT NULL,
-                        group_id TEXT NOT NULL,
-                        achievement_id TEXT NOT NULL,
-                        unlock_time TEXT NOT NULL,
-                        PRIMARY KEY (user_id, group_id, achievement_id)
-                    )''')
-                
-                # 时段统计表
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS hour_stats (
-                        user_id TEXT NOT NULL,
-                        group_id TEXT NOT NULL,
-                        hour_group INTEGER NOT NULL,
-                        count INTEGER DEFAULT 0,
-                        date TEXT NOT NULL,
-                        PRIMARY KEY (user_id, group_id, hour_group, date)
-                    )''')
-                
-                # 自动清理旧数据
-                cutoff = (datetime.now() - timedelta(days=self.max_record_days)).strftime('%Y-%m-%d %H:%M:%S')
-                cursor.execute("DELETE FROM chat_records WHERE create_time < ?", (cutoff,))
-                logger.info(f"已清理 {self.max_record_days} 天前的聊天记录")
-                
-                conn.commit()
-                logger.info("数据库表创建完成")
-        except sqlite3.Error as e:
-            logger.critical(f"数据库初始化失败: {str(e)}")
-            if os.path.exists(self.db_path):
-                os.remove(self.db_path)
-            raise RuntimeError("数据库初始化失败，请检查日志")
+        """初始化数据库：按版本号执行未应用的迁移"""
+        for shard in self.shards:
+            with shard.db.transaction() as conn:
+                version = migrate(conn)
+        logger.info(f"数据库表创建完成(v{version}，{len(self.shards)}个分片)")
+
+    def _init_storage(self):
+        """后台初始化：迁移完成后启动写入队列、落盘缓存的消息并启动数据清理
+
+        库被锁或暂时不可用时退避重试，不删除库文件；版本不兼容等无法重试的错误记录后停止，消息不再落盘。
+        """
+        start = time.perf_counter()
+        delay = 1
+        while True:
+            try:
+                self.init_database()
+                break
+            except sqlite3.Error as e:
+                logger.error(f"[GroupFun] 数据库初始化失败，{delay}秒后重试: {e}")
+            except Exception as e:
+                logger.critical(f"[GroupFun] 数据库初始化失败: {e}", exc_info=True)
+                self.init_error = e
+                return
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, 60)
+        if self._stop.is_set():
+            return
+        self.metrics.observe("stage", "init", (time.perf_counter() - start) * 1000)
+
+        with self._pending_lock:
+            pending = list(self._pending)
+            self._pending.clear()
+            self.db_ready.set()
+        if self.writer:
+            self.writer.start()
+        if pending:
+            logger.info(f"[GroupFun] 落盘数据库就绪前缓存的 {len(pending)} 条消息")
+            try:
+                self.write_batch(pending)
+            except Exception as e:
+                logger.error(f"[GroupFun] 缓存消息落盘失败: {e}", exc_info=True)
+        # 单写者模式下只由写者进程清理，转发进程在接管写入时再启动
+        if self.relay is None or self.relay.is_owner:
+            self._start_compactors()
+
+    def _start_compactors(self):
+        """启动各分片的后台数据清理，只启动一次"""
+        if not (self.config.get("retention") or {}).get("enabled", True):
+            return
+        with self._pending_lock:
+            if self._compactors_started:
+                return
+            self._compactors_started = True
+        for index, compactor in enumerate(self.compactors):
+            # 错开各分片的首次清理
+            compactor.start(delay_seconds=10 + index * 5)
+
+    def _create_writer(self, conf):
+        """创建后台写入队列，关闭时退化为逐条同步写入"""
+        if not conf.get("enabled", True):
+            return None
+        writer = WriteBehindQueue(
+            self.flush_records,
+            batch_size=conf.get("batch_size", 200),
+            flush_interval_ms=conf.get("flush_interval_ms", 200),
+            max_size=conf.get("max_size", 10000),
+            overflow=conf.get("overflow", "drop_old"),
+            block_timeout_ms=conf.get("block_timeout_ms", 1000),
+        )
+        # 数据库就绪后由 _init_storage 启动，此前入队的消息留在队列中
+        return writer
+
+    def _create_relay(self, conf):
+        """单写者模式：多进程部署时只有一个进程写库，其余进程经本地端口把消息转发给它"""
+        if not conf.get("enabled", False):
+            return None
+        # 未配置 token 时各进程共用插件目录下自动生成的令牌文件
+        token = conf.get("token") or load_token(os.path.join(self.curdir, "relay_token"))
+        relay = WriteRelay(conf.get("address", "127.0.0.1:47231"), self._accept_records, MessageRecord, token)
+        relay.start()
+        return relay
+
+    def _create_compactors(self, conf):
+        """每个分片一个后台数据清理任务，过期数据分批删除，数据库就绪后才启动"""
+        compactors = []
+        for shard in self.shards:
+            compactor = Compactor(
+                shard.db,
+                self.max_record_days,
+                batch_size=conf.get("batch_size", 5000),
+                interval_minutes=conf.get("interval_minutes", 60),
+                pause_ms=conf.get("pause_ms", 20),
+                write_lock=self.leaderboard.commit_lock,
+                on_memes_pruned=self.memes.clear,
+                partitions=shard.partitions,
+            )
+            compactors.append(compactor)
+        return compactors
+
+    def _create_reporter(self, conf):
+        """按配置定期把运行指标写入日志和/或 Prometheus 文本文件（供 node_exporter textfile 采集）"""
+        if not conf.get("log", False) and not conf.get("prometheus_file"):
+            return None
+        reporter = PeriodicReporter(lambda: self.report_metrics(conf), conf.get("interval_seconds", 60))
+        reporter.start()
+        return reporter
+
+    def report_metrics(self, conf):
+        if conf.get("log", False):
+            logger.info(f"[GroupFun] 运行指标: {self.plugin_stats()}")
+        path = conf.get("prometheus_file")
+        if path:
+            gauges = {}
+            if self.writer:
+                stats = self.writer.stats()
+                gauges = {"write_queue_depth": stats["depth"], "write_queue_dropped": stats["dropped"],
+                          "write_queue_failed": stats["failed"], "write_queue_flushed": stats["flushed"]}
+            # 先写临时文件再替换，采集方不会读到写了一半的文件
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(self.metrics.prometheus(gauges))
+            os.replace(path + ".tmp", path)
+
+    def plugin_stats(self):
+        """各阶段和命令的耗时统计、计数器、慢操作，以及写入队列和单写者转发的状态"""
+        stats = self.metrics.snapshot()
+        if self.writer:
+            stats["write_queue"] = self.writer.stats()
+        if self.relay:
+            stats["relay"] = self.relay.stats()
+        return stats
+
+    def close(self):
+        """插件卸载/进程退出时清空写入队列并关闭连接"""
+        self._stop.set()
+        self._init_thread.join(5)
+        if not self.db_ready.is_set():
+            buffered = len(self._pending) + (self.writer.stats()["depth"] if self.writer else 0)
+            if buffered:
+                logger.warning(f"[GroupFun] 数据库未就绪，{buffered} 条缓存的消息未落盘")
+        if self.reporter:
+            self.reporter.close()
+        for compactor in self.compactors:
+            compactor.close()
+        # 先停止接收转发，让其他进程尽快接管写入，再把本进程队列中剩余的消息落盘
+        if self.relay:
+            self.relay.close()
+        if self.writer:
+            self.writer.close()
+        self.shards.close_all()
 
     def on_handle_context(self, e_context: EventContext):
         """处理命令"""
@@ -133,36 +301,62 @@ class GroupFun(Plugin):
         
         if not e_context["context"]["isgroup"]:
             return
+
+        command = next((name for name in COMMANDS if content.startswith(name)), None)
+        if command is None or (command == "插件状态" and msg.actual_user_id not in self.admin_users):
+            return
             
         reply = Reply()
         reply.type = ReplyType.TEXT
+        start = time.perf_counter()
         
         try:
+            # 0. 数据库尚未就绪（后台迁移中）
+            if command != "插件状态" and not self.db_ready.is_set():
+                reply.content = "数据库初始化失败，请检查日志" if self.init_error else "数据正在加载，请稍后再试~"
             # 1. 水王排行功能
-            if content.startswith("今日水王"):
+            elif command == "今日水王":
                 reply.content = self.get_water_king(msg.other_user_id)
-            elif content.startswith("本周水王"):
+            elif command == "本周水王":
                 reply.content = self.get_water_king(msg.other_user_id, "week")
-            elif content.startswith("本月水王"):
+            elif command == "本月水王":
                 reply.content = self.get_water_king(msg.other_user_id, "month")
             
             # 2. 梗百科功能
-            elif content.startswith("梗百科") or content.startswith("梗排行榜"):
-                reply.content = self.get_meme_rank(msg.other_user_id)
+            elif command in ("梗百科", "梗排行榜"):
+                reply.content = self.replies.get(("梗排行榜", msg.other_user_id),
+                                                 lambda: self.get_meme_rank(msg.other_user_id))
             
             # 3. 成就系统
-            elif content.startswith("我的成就"):
+            elif command == "我的成就":
                 reply.content = self.get_user_achievements(msg.other_user_id, msg.actual_user_id)
+            
+            # 4. 活跃时段统计
+            elif command == "活跃热力图":
+                reply.content = self.replies.get((command, msg.other_user_id),
+                                                 lambda: self.analytics.heatmap(msg.other_user_id))
+            elif command == "高峰时段":
+                reply.content = self.replies.get((command, msg.other_user_id),
+                                                 lambda: self.analytics.peak_hours(msg.other_user_id))
+            elif command == "我的活跃时段":
+                reply.content = self.replies.get(
+                    (command, msg.other_user_id, msg.actual_user_id, msg.actual_user_nickname),
+                    lambda: self.analytics.user_profile(msg.other_user_id, msg.actual_user_id,
+                                                        msg.actual_user_nickname))
+            
+            # 5. 运行状态（仅管理员）
             else:
-                return
+                reply.content = self.get_plugin_status()
                 
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
         except Exception as e:
             logger.error(f"[GroupFun]处理命令异常：{e}")
+            self.metrics.incr("command_errors")
             reply.content = "功能暂时不可用"
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
+        self.metrics.observe("command", command, (time.perf_counter() - start) * 1000, msg.other_user_id)
 
     def on_receive_message(self, e_context: EventContext):
         """处理所有消息，用于数据收集"""
@@ -174,390 +368,422 @@ class GroupFun(Plugin):
         if not msg.is_group:
             return
             
+        start = time.perf_counter()
         try:
-            # 保存聊天记录
+            # 只在聊天线程上做快照入队，落盘和成就检测由后台写入线程完成
             self.save_message(msg)
-            
-            # 检测梗（短消息或重复消息）
-            if self.is_potential_meme(msg.content):
-                self.check_meme_creation(msg)
-            
-            # 检查水王成就
-            self.check_water_king(msg)
-            
-            # 检查时段成就
-            hour = datetime.now().hour
-            self.check_time_achievements(msg, hour)
-            self.update_hour_stats(msg, hour)
+            self.metrics.incr("messages_received")
         except Exception as e:
             logger.error(f"[GroupFun]处理消息异常：{e}")
+            self.metrics.incr("receive_errors")
+        self.metrics.observe("stage", "receive", (time.perf_counter() - start) * 1000)
+
+    def flush_records(self, records):
+        """写入队列的落盘入口：单写者模式下非写者进程把消息转发出去，写者已退出时接管后自己写"""
+        if self.relay and not self.relay.is_owner:
+            if self.relay.send(records):
+                return
+            # 刚接管写入；数据库尚未就绪时由 _init_storage 启动清理
+            if self.db_ready.is_set():
+                self._start_compactors()
+        self.write_batch(records)
+
+    def _accept_records(self, records):
+        """写者进程收到其他进程转发的消息，与本进程的消息进同一个写入队列"""
+        if self.writer:
+            for record in records:
+                self.writer.put(record)
+        else:
+            self.write_batch(records)
+
+    def _buffer(self, records):
+        """数据库就绪前缓存消息，超出容量时按溢出策略丢弃并计入 pending_dropped，需持有 _pending_lock"""
+        dropped = 0
+        for record in records:
+            if len(self._pending) >= self._pending_max:
+                dropped += 1
+                if self._pending_overflow != "drop_old":
+                    continue
+                self._pending.popleft()
+            self._pending.append(record)
+        if dropped:
+            if not self._pending_dropped:
+                logger.warning(f"[GroupFun] 数据库未就绪且缓存已满（{self._pending_max} 条），开始丢弃消息")
+            self._pending_dropped += dropped
+            self.metrics.incr("pending_dropped", dropped)
+
+    def write_batch(self, records):
+        """批量落盘：按群所在分片分组，每个分片一个事务，写入后逐条做成就检测
+
+        某个分片失败时其余分片照常提交，只把失败分片的消息交给写入队列重试。
+        数据库就绪前（未开启写入队列时）先缓存，就绪后一并落盘。
+        """
+        if not self.db_ready.is_set():
+            with self._pending_lock:
+                if not self.db_ready.is_set():
+                    self._buffer(records)
+                    return
+        failed, error = [], None
+        start = time.perf_counter()
+        with self.leaderboard.commit_lock:
+            # 等锁时间：查询命令加载榜单或后台清理梗候选时会持有该锁
+            self.metrics.observe("stage", "lock_wait", (time.perf_counter() - start) * 1000)
+            for shard, shard_records in self.shards.route(records):
+                try:
+                    if shard.partitions:
+                        # ATTACH 不能在事务内执行，先把本批涉及的月份挂到写入线程的连接上
+                        shard.partitions.attach(shard.db.connection(),
+                                                {month_of(r.create_time) for r in shard_records})
+                    self._write_batch(shard, shard_records)
+                except Exception as e:
+                    # 回滚后内存中的梗候选和成就计数可能比库里多，丢弃后按需重新加载
+                    self.memes.clear()
+                    self.profiles.clear()
+                    shard.achievements.clear()
+                    if self.content_store:
+                        self.content_store.clear()
+                    failed.extend(shard_records)
+                    error = e
+                    self.metrics.incr("write_errors")
+                    continue
+                self.leaderboard.apply(shard_records)
+                self.progress_cache.invalidate(shard_records)
+                self.metrics.incr("messages_written", len(shard_records))
+        self.metrics.observe("stage", "write_batch", (time.perf_counter() - start) * 1000, f"{len(records)}条")
+        if len(failed) == len(records) and error is not None:
+            raise error
+        if failed:
+            raise PartialFlushError(failed) from error
+
+    def _write_batch(self, shard, records):
+        """批量落盘的事务部分，records 都属于同一分片"""
+        timer = self.metrics.timer
+        with shard.db.transaction() as conn:
+            # 水王/时段成就在内存中判断，只在解锁时写库；须在更新统计表之前调用
+            with timer("stage", "achievements"):
+                shard.achievements.observe(conn, records)
+            with timer("stage", "save"):
+                self.save_records(conn, shard, records)
+            with timer("stage", "profiles"):
+                self.profiles.save(conn, records)
+            with timer("stage", "hour_stats"):
+                self.update_hour_stats(conn, records)
+            with timer("stage", "daily_counts"):
+                self.update_daily_counts(conn, records)
+            
+            with timer("stage", "memes"):
+                for record in records:
+                    # 检测梗（短消息或重复消息）
+                    if self.is_potential_meme(record.content):
+                        self.check_meme_creation(record)
+            commit_start = time.perf_counter()
+        self.metrics.observe("stage", "commit", (time.perf_counter() - commit_start) * 1000)
 
     def is_potential_meme(self, content):
         """判断是否是潜在的梗消息"""
-        # 排除包含特定关键词的消息
-        exclude_keywords = ["梗", "水王", "成就"]
-        if any(keyword in content for keyword in exclude_keywords):
-            return False
-        
-        # 短消息(小于50字符)或包含表情符号
-        return len(content) <= 50 or any(c in content for c in ["🤪", "😂", "🐶", "🐱"])
+        return is_potential_meme(content)
 
     def save_message(self, msg):
-        """安全保存消息"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT INTO chat_records 
-                    (group_id, user_nickname, user_id, content, create_time, hour_group)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    msg.other_user_id,
-                    msg.actual_user_nickname,
-                    msg.actual_user_id,
-                    msg.content,
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    datetime.now().hour
-                ))
-                conn.commit()
-        except sqlite3.OperationalError as e:
-            if "no such column" in str(e):
-                logger.warning("检测到旧版数据库，尝试重建...")
-                os.remove(self.db_path)
-                self.init_database()
-                self.save_message(msg)
+        """保存消息：生成快照后放入写入队列"""
+        now = datetime.now()
+        record = MessageRecord(
+            msg.other_user_id,
+            msg.actual_user_id,
+            msg.actual_user_nickname,
+            msg.content,
+            now.strftime('%Y-%m-%d %H:%M:%S'),
+            now.hour,
+            now.strftime('%Y-%m-%d'),
+            meme_key(msg.content),
+        )
+        if self.writer:
+            self.writer.put(record)
+        else:
+            self.flush_records([record])
+
+    def save_records(self, conn, shard, records):
+        """批量写入聊天记录，按月分区时写入各自月份的分区表
+
+        紧凑存储时昵称换成 chat_nicknames 的 id，可能成梗的正文去重登记到 chat_contents，其余正文截断后留在行内。
+        """
+        partitions = shard.partitions
+        store = self.content_store
+        if store:
+            nickname_ids = store.nickname_ids(conn, shard.index, {r.actual_user_nickname for r in records})
+            contents = {}
+        tables = defaultdict(list)
+        for r in records:
+            table = partitions.table(r.create_time) if partitions else "chat_records"
+            hashed = content_hash(r.content)
+            if store:
+                inline, interned = store.content(r.content)
+                if interned is not None:
+                    contents[hashed] = interned
+                # 截断的正文不参与梗匹配，不保存 meme_key
+                row = (r.other_user_id, '', r.actual_user_id, inline, hashed,
+                       r.meme_key if interned is not None else None, r.create_time, r.hour,
+                       nickname_ids[r.actual_user_nickname])
             else:
-                raise
+                row = (r.other_user_id, r.actual_user_nickname, r.actual_user_id, r.content,
+                       hashed, r.meme_key, r.create_time, r.hour, None)
+            tables[table].append(row)
+        if store and contents:
+            store.save_contents(conn, shard.index, contents, records[-1].date)
+        for table, rows in tables.items():
+            conn.executemany(f'''
+                INSERT INTO {table} 
+                (group_id, user_nickname, user_id, content, content_hash, meme_key, create_time, hour_group,
+                 nickname_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
 
     def check_meme_creation(self, msg):
-        """三人成梗检测"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # 1. 检查是否已有3人使用
+        """三人成梗检测：每出现一个新的 (梗, 引用者) 组合只计数一次
+
+        在批量落盘的事务内调用，出错时异常交给 write_batch 回滚整批并重试，不会只提交梗词典而漏掉梗数。
+        """
+        shard = self.shards.shard(msg.other_user_id)
+        with shard.db.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # 1. 更新梗候选，同一用户重复发送不再计数（热点候选直接命中内存）
+            # 按入库时算好的归一化键匹配，“哈哈哈哈”和“哈哈哈哈哈😂”归为同一个梗
+            key = (msg.other_user_id, msg.meme_key)
+            candidate, new_user = self.memes.observe(conn, key, msg)
+            if candidate is None or not new_user:
+                return
+            user_count = len(candidate.users)
+            if user_count < MEME_THRESHOLD:
+                return
+            
+            # 2. 原创者即候选的首位发送者，其余用户都算引用者；梗词典展示首次出现的原文
+            creator, creator_id = candidate.first_nickname, candidate.first_user_id
+            meme_text = candidate.content
+            if candidate.promoted:
+                increment = 1
                 cursor.execute('''
-                    SELECT COUNT(DISTINCT user_id) 
-                    FROM chat_records 
-                    WHERE group_id = ? AND content = ?
-                ''', (msg.other_user_id, msg.content))
-                user_count = cursor.fetchone()[0]
-                
-                if user_count >= 3:
-                    # 2. 获取原创者
+                    UPDATE meme_dict SET usage_count = usage_count + 1 
+                    WHERE group_id = ? AND meme_text = ?
+                ''', (msg.other_user_id, meme_text))
+            else:
+                # 3. 刚成梗：写入梗词典，此前的引用者一次性计入
+                increment = user_count - 1
+                existing = cursor.execute('''
+                    SELECT creator, creator_id FROM meme_dict WHERE group_id = ? AND meme_text = ?
+                ''', (msg.other_user_id, meme_text)).fetchone()
+                if existing:
+                    # 候选过期后再次成梗：沿用梗词典中的原创者并累加引用数，此后的引用也记在原创者名下
+                    creator, creator_id = existing
                     cursor.execute('''
-                        SELECT user_nickname, user_id 
-                        FROM chat_records 
-                        WHERE group_id = ? AND content = ?
-                        ORDER BY create_time ASC LIMIT 1
-                    ''', (msg.other_user_id, msg.content))
-                    creator, creator_id = cursor.fetchone()
-                    
-                    # 3. 更新梗词典
+                        UPDATE meme_dict SET usage_count = usage_count + ?
+                        WHERE group_id = ? AND meme_text = ?
+                    ''', (increment, msg.other_user_id, meme_text))
+                else:
                     cursor.execute('''
-                        INSERT OR IGNORE INTO meme_dict 
-                        (group_id, meme_text, creator, creator_id, create_time)
-                        VALUES (?, ?, ?, ?, ?)
-                        ON CONFLICT(group_id, meme_text) 
-                        DO UPDATE SET usage_count = usage_count + 1
+                        INSERT INTO meme_dict 
+                        (group_id, meme_text, creator, creator_id, usage_count, create_time)
+                        VALUES (?, ?, ?, ?, ?, ?)
                     ''', (
                         msg.other_user_id,
-                        msg.content,
+                        meme_text,
                         creator,
                         creator_id,
-                        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        increment,
+                        msg.create_time
                     ))
-                    
-                    # 4. 更新用户梗数
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO user_meme_stats
-                        (user_id, group_id, meme_count)
-                        VALUES (?, ?, 0)
-                    ''', (creator_id, msg.other_user_id))
-                    
-                    cursor.execute('''
-                        UPDATE user_meme_stats 
-                        SET meme_count = meme_count + 1 
-                        WHERE user_id = ? AND group_id = ?
-                    ''', (creator_id, msg.other_user_id))
-                    
-                    # 5. 检查梗王成就
-                    cursor.execute('''
-                        SELECT meme_count FROM user_meme_stats
-                        WHERE user_id = ? AND group_id = ?
-                    ''', (creator_id, msg.other_user_id))
-                    
-                    if cursor.fetchone()[0] >= 10:
-                        self.grant_achievement(creator_id, msg.other_user_id, "meme_lord")
-                        logger.info(f"[成就] {creator} 成为梗王！")
-                    
-                    conn.commit()
-                    logger.info(f"[新梗] {creator} 的「{msg.content}」被{user_count}人使用")
-        except Exception as e:
-            logger.error(f"[梗检测异常] {e}", exc_info=True)
-
-    def check_water_king(self, msg):
-        """水王检测"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                today = datetime.now().strftime('%Y-%m-%d')
-                
-                cursor.execute('''
-                    SELECT COUNT(*) FROM chat_records 
-                    WHERE group_id = ? AND user_id = ? AND date(create_time) = ?
-                ''', (msg.other_user_id, msg.actual_user_id, today))
-                
-                if cursor.fetchone()[0] >= 50:
-                    self.grant_achievement(msg.actual_user_id, msg.other_user_id, "water_king")
-        except Exception as e:
-            logger.error(f"[水王检测异常] {e}")
-
-    def check_time_achievements(self, msg, hour):
-        """时段成就检测"""
-        try:
-            achievement_id = None
-            hour_range = None
+                    logger.info(f"[新梗] {creator} 的「{meme_text}」被{user_count}人使用")
+                self.memes.mark_promoted(conn, candidate, creator, creator_id)
             
-            if 0 <= hour < 5:  # 夜猫子
-                achievement_id = "night_owl"
-                hour_range = (0, 5)
-            elif 6 <= hour < 8:  # 早起鸟
-                achievement_id = "early_bird"
-                hour_range = (6, 8)
-            else:
-                return
-                
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                today = datetime.now().strftime('%Y-%m-%d')
-                
-                cursor.execute('''
-                    SELECT SUM(count) FROM hour_stats 
-                    WHERE user_id = ? AND group_id = ? 
-                      AND hour_group BETWEEN ? AND ?
-                      AND date = ?
-                ''', (
-                    msg.actual_user_id,
-                    msg.other_user_id,
-                    hour_range[0],
-                    hour_range[1]-1,
-                    today
-                ))
-                
-                count = cursor.fetchone()[0] or 0
-                if count >= 3:
-                    self.grant_achievement(msg.actual_user_id, msg.other_user_id, achievement_id)
-        except Exception as e:
-            logger.error(f"[时段成就异常] {e}")
+            # 4. 更新用户梗数
+            cursor.execute('''
+                INSERT INTO user_meme_stats
+                (user_id, group_id, meme_count)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id, group_id) 
+                DO UPDATE SET meme_count = meme_count + excluded.meme_count
+            ''', (creator_id, msg.other_user_id, increment))
+            
+            # 5. 检查梗王成就
+            shard.achievements.add_memes(conn, msg.other_user_id, creator_id, increment, msg.create_time)
 
-    def grant_achievement(self, user_id, group_id, achievement_id):
-        """授予成就"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT OR IGNORE INTO user_achievements
-                    (user_id, group_id, achievement_id, unlock_time)
-                    VALUES (?, ?, ?, ?)
-                ''', (
-                    user_id,
-                    group_id,
-                    achievement_id,
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ))
-                conn.commit()
-        except Exception as e:
-            logger.error(f"[成就授予失败] {e}")
+    def get_plugin_status(self):
+        """插件状态：消息计数、写入队列、各阶段和命令耗时、最近的慢操作"""
+        stats = self.plugin_stats()
+        counters = stats["counters"]
+        minutes = stats["uptime_seconds"] // 60
+        lines = ["【插件状态📊】",
+                 f"运行 {minutes // 60}小时{minutes % 60}分，{len(self.shards)}个分片",
+                 f"消息: 收到 {counters.get('messages_received', 0)}，落盘 {counters.get('messages_written', 0)}，"
+                 f"处理异常 {counters.get('receive_errors', 0)}，写入异常 {counters.get('write_errors', 0)}"]
+        if not self.db_ready.is_set():
+            lines.append(f"数据库: 初始化失败（{self.init_error}）" if self.init_error
+                         else f"数据库: 加载中，已缓存 {len(self._pending)} 条")
+        if counters.get("pending_dropped"):
+            lines.append(f"就绪前缓存已满丢弃: {counters['pending_dropped']} 条")
+        queue = stats.get("write_queue")
+        if queue:
+            lines.append(f"写入队列: {queue['depth']}/{self.writer.max_size}（峰值 {queue['max_depth']}），"
+                         f"丢弃 {queue['dropped']}，失败 {queue['failed']}")
+        relay = stats.get("relay")
+        if relay:
+            lines.append(f"单写者: {'写者' if relay['owner'] else '转发'}，收到 {relay['received']}，转发 {relay['forwarded']}")
+        for kind, title in (("stage", "处理阶段"), ("command", "命令")):
+            if stats.get(kind):
+                lines.append(f"=== {title}耗时 ms（p50/p99/max 次数）===")
+                lines.extend(f"{name}: {item['p50']}/{item['p99']}/{item['max']} ×{item['count']}"
+                             for name, item in stats[kind].items())
+        if stats["slow"]:
+            lines.append(f"=== 最近的慢操作（≥{self.metrics.slow_ms}ms）===")
+            lines.extend(f"{when[11:]} {kind}/{name} {ms}ms {detail or ''}".rstrip()
+                         for when, kind, name, ms, detail in stats["slow"][-5:])
+        return "\n".join(lines)
 
     def get_water_king(self, group_id, period="day"):
         """获取水王排行榜"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                if period == "day":
-                    date_filter = "date(create_time) = date('now')"
-                    title = "今日水王🏆"
-                elif period == "week":
-                    date_filter = "date(create_time) >= date('now', 'weekday 0', '-7 days')"
-                    title = "本周水王🏆"
-                elif period == "month":
-                    date_filter = "strftime('%Y-%m', create_time) = strftime('%Y-%m', 'now')"
-                    title = "本月水王🏆"
-                else:
-                    return "无效的时间范围"
-                
-                cursor.execute(f'''
-                    SELECT user_nickname, COUNT(*) as count 
-                    FROM chat_records 
-                    WHERE group_id = ? AND {date_filter}
-                    GROUP BY user_id 
-                    ORDER BY count DESC 
-                    LIMIT 3
-                ''', (group_id,))
-                
-                results = cursor.fetchall()
-                if not results:
-                    return f"{title.replace('🏆', '')}还没有水王哦~"
-                
-                rank = [f"【{title}】"]
-                medals = ["🥇", "🥈", "🥉"]
-                for i, (user, count) in enumerate(results):
-                    rank.append(f"{medals[i]} {user}: {count}条")
-                
-                return "\n".join(rank)
+            titles = {"day": "今日水王🏆", "week": "本周水王🏆", "month": "本月水王🏆"}
+            if period not in titles:
+                return "无效的时间范围"
+            title = titles[period]
+            start, end = period_range(period)
+            
+            # 命中缓存时不查库，未命中时从按天汇总表加载本周期数据
+            results = self.leaderboard.top(group_id, period, start, end, self.water_king_top_n)
+            if not results:
+                return f"{title.replace('🏆', '')}还没有水王哦~"
+            
+            rank = [f"【{title}】"]
+            medals = ["🥇", "🥈", "🥉"]
+            for i, (user, count) in enumerate(results):
+                medal = medals[i] if i < len(medals) else f"{i + 1}."
+                rank.append(f"{medal} {user}: {count}条")
+            
+            return "\n".join(rank)
         except Exception as e:
             logger.error(f"[水王榜异常] {e}")
             return "数据获取失败"
 
+    def _load_period_counts(self, conn, group_id, start, end):
+        """从按天汇总表加载周期内每人的发言数，昵称取 user_profiles 中的当前值
+
+        之后的新消息由 apply 带上发言时的昵称，改名后榜单随之更新。
+        """
+        rows = conn.execute('''
+            SELECT d.user_id, COALESCE(p.nickname, d.user_nickname), d.count, d.date
+            FROM (
+                SELECT user_id, user_nickname, SUM(count) AS count, MAX(date) AS date
+                FROM daily_user_counts 
+                WHERE group_id = ? AND date >= ? AND date < ?
+                GROUP BY user_id
+            ) d
+            LEFT JOIN user_profiles p ON p.group_id = ? AND p.user_id = d.user_id
+        ''', (group_id, start, end, group_id)).fetchall()
+        return {user_id: [nickname, count] for user_id, nickname, count, _ in rows}
+
     def get_meme_rank(self, group_id):
         """梗排行榜"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self.shards.db(group_id).reader() as conn:
                 cursor = conn.cursor()
-                
+                cursor.row_factory = sqlite3.Row
+                # 创建者显示当前昵称，没有昵称记录时用成梗时保存的
                 cursor.execute('''
-                    SELECT meme_text, creator, usage_count 
-                    FROM meme_dict 
-                    WHERE group_id = ? 
-                    ORDER BY usage_count DESC 
+                    SELECT m.meme_text, COALESCE(p.nickname, m.creator) AS creator, m.usage_count 
+                    FROM meme_dict m
+                    LEFT JOIN user_profiles p ON p.group_id = m.group_id AND p.user_id = m.creator_id
+                    WHERE m.group_id = ? 
+                    ORDER BY m.usage_count DESC 
                     LIMIT 10
                 ''', (group_id,))
-                
                 results = cursor.fetchall()
-                if not results:
-                    return "本群还没有流行梗哦~"
-                
-                rank = ["【梗王排行榜🤪】"]
-                for i, row in enumerate(results, 1):
-                    rank.append(f"{i}. {row['meme_text']} (by {row['creator']}, 被引{row['usage_count']}次)")
-                
-                return "\n".join(rank)
+            
+            if not results:
+                return "本群还没有流行梗哦~"
+            
+            rank = ["【梗王排行榜🤪】"]
+            for i, row in enumerate(results, 1):
+                rank.append(f"{i}. {row['meme_text']} (by {row['creator']}, 被引{row['usage_count']}次)")
+            
+            return "\n".join(rank)
         except Exception as e:
             logger.error(f"[梗榜异常] {e}")
             return "数据获取失败"
     def get_user_achievements(self, group_id, user_id):
-        """用户成就查询"""
+        """用户成就查询，结果短时缓存，本人有新消息入库后失效"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-            
-                # 已解锁成就
-                unlocked = cursor.execute('''
-                    SELECT achievement_id FROM user_achievements
-                    WHERE user_id = ? AND group_id = ?
-                ''', (user_id, group_id)).fetchall()
-                unlocked_ids = {row[0] for row in unlocked}
-            
-                # 获取进度数据
-                today = datetime.now().strftime('%Y-%m-%d')
-                progress = []
-            
-                # 水王进度
-                if "water_king" in unlocked_ids:
-                    progress.append("🏆水王: 已完成")
-                else:
-                    cursor.execute('''
-                        SELECT COUNT(*) FROM chat_records 
-                        WHERE group_id = ? AND user_id = ? AND date(create_time) = ?
-                    ''', (group_id, user_id, today))
-                    water_count = cursor.fetchone()[0]
-                    progress.append(f"🏆水王: {water_count}/50条")
-            
-                # 夜猫子进度
-                if "night_owl" in unlocked_ids:
-                    progress.append("🌙夜猫子: 已完成")
-                else:
-                    cursor.execute('''
-                        SELECT SUM(count) FROM hour_stats 
-                        WHERE user_id = ? AND group_id = ? 
-                        AND hour_group BETWEEN 0 AND 4 
-                        AND date = ?
-                    ''', (user_id, group_id, today))
-                    night_count = cursor.fetchone()[0] or 0
-                    progress.append(f"🌙夜猫子: {night_count}/3次")
-            
-                # 早起鸟进度
-                if "early_bird" in unlocked_ids:
-                    progress.append("🐦早起鸟: 已完成")
-                else:
-                    cursor.execute('''
-                        SELECT SUM(count) FROM hour_stats 
-                        WHERE user_id = ? AND group_id = ? 
-                        AND hour_group BETWEEN 6 AND 7 
-                        AND date = ?
-                    ''', (user_id, group_id, today))
-                    morning_count = cursor.fetchone()[0] or 0
-                    progress.append(f"🐦早起鸟: {morning_count}/3次")
-            
-                # 梗王进度
-                cursor.execute('''
-                    SELECT meme_count FROM user_meme_stats
-                    WHERE user_id = ? AND group_id = ?
-                ''', (user_id, group_id))
-                meme_result = cursor.fetchone()
-                meme_count = meme_result[0] if meme_result else 0
-            
-                if "meme_lord" in unlocked_ids:
-                    progress.append("🤪梗王: 已完成")
-                else:
-                    progress.append(f"🤪梗王: {meme_count}/10个")
-                    # 自动检查并授予梗王成就
-                    if meme_count >= 10:
-                        self.grant_achievement(user_id, group_id, "meme_lord")
-                        unlocked_ids.add("meme_lord")
-            
-                # 构建回复
-                lines = ["【我的成就🏅】"]
-            
-                if unlocked_ids:
-                    lines.append("=== 已解锁 ===")
-                    for ach_id, ach in self.ACHIEVEMENTS.items():
-                        if ach_id in unlocked_ids:
-                            lines.append(f"{ach['name']}: {ach['desc']}")
-            
-                lines.append("\n=== 当前进度 ===")
-                lines.extend(progress)
-            
-                return "\n".join(lines)
+            key = (group_id, user_id)
+            reply, epoch = self.progress_cache.get(key)
+            if reply is None:
+                reply = self._build_achievements(group_id, user_id)
+                self.progress_cache.put(key, epoch, reply)
+            return reply
         except Exception as e:
             logger.error(f"[成就查询异常] {e}")
             return "成就数据获取失败"
 
-    def update_hour_stats(self, msg, hour):
-        """更新时段统计数据"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                today = datetime.now().strftime('%Y-%m-%d')
-                conn.execute('''
-                    INSERT INTO hour_stats 
-                    (user_id, group_id, hour_group, count, date)
-                    VALUES (?, ?, ?, 1, ?)
-                    ON CONFLICT(user_id, group_id, hour_group, date) 
-                    DO UPDATE SET count = count + 1
-                ''', (
-                    msg.actual_user_id,
-                    msg.other_user_id,
-                    hour,
-                    today
-                ))
-                conn.commit()
-        except Exception as e:
-            logger.error(f"[时段统计更新失败] {e}")
+    def _build_achievements(self, group_id, user_id):
+        """一次查询取回已解锁成就和全部进度计数，生成回复"""
+        shard = self.shards.shard(group_id)
+        today = datetime.now().strftime('%Y-%m-%d')
+        with shard.db.reader() as conn:
+            unlocked_ids, values = shard.achievements.progress(conn, group_id, user_id, today)
+        progress = []
+        for ach_id, ach in self.ACHIEVEMENTS.items():
+            if ach_id in unlocked_ids:
+                progress.append(f"{ach['name']}: 已完成")
+            else:
+                progress.append(f"{ach['name']}: {values[ach_id]}/{ach['condition']}{ach['unit']}")
+    
+        # 构建回复
+        lines = ["【我的成就🏅】"]
+    
+        if unlocked_ids:
+            lines.append("=== 已解锁 ===")
+            for ach_id, ach in self.ACHIEVEMENTS.items():
+                if ach_id in unlocked_ids:
+                    lines.append(f"{ach['name']}: {ach['desc']}")
+    
+        lines.append("\n=== 当前进度 ===")
+        lines.extend(progress)
+    
+        return "\n".join(lines)
+
+    def update_hour_stats(self, conn, records):
+        """更新时段统计数据（同一批内相同时段先合并计数）"""
+        counts = Counter((r.actual_user_id, r.other_user_id, r.hour, r.date) for r in records)
+        conn.executemany('''
+            INSERT INTO hour_stats 
+            (user_id, group_id, hour_group, count, date)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, group_id, hour_group, date) 
+            DO UPDATE SET count = count + excluded.count
+        ''', [key[:3] + (count, key[3]) for key, count in counts.items()])
+
+    def update_daily_counts(self, conn, records):
+        """增量维护按天汇总的发言计数"""
+        counts = Counter((r.other_user_id, r.date, r.actual_user_id) for r in records)
+        nicknames = {(r.other_user_id, r.actual_user_id): r.actual_user_nickname for r in records}
+        conn.executemany('''
+            INSERT INTO daily_user_counts 
+            (group_id, date, user_id, count, user_nickname)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(group_id, date, user_id) 
+            DO UPDATE SET count = count + excluded.count, user_nickname = excluded.user_nickname
+        ''', [key + (count, nicknames[(key[0], key[2])]) for key, count in counts.items()])
 
     def get_help_text(self, **kwargs):
-        return """
+        rules = "\n".join(f"- {ach['name']}：{ach['desc']}" for ach in self.ACHIEVEMENTS.values())
+        return f"""
 【群聊娱乐中心使用说明】
 1. 今日水王 - 查看今日发言排行榜
 2. 本周水王 - 查看本周发言排行榜
 3. 本月水王 - 查看本月发言排行榜
 4. 梗排行榜 - 查看本群流行梗
 5. 我的成就 - 查看已获得成就和进度
+6. 活跃热力图 - 查看本群按星期和小时的发言热力图
+7. 高峰时段 - 查看本群最活跃的时段
+8. 我的活跃时段 - 查看自己的24小时发言分布
 
 成就系统：
-- 🤪 梗王：原创梗被10人引用
-- 🏆 水王：单日发言50条
-- 🌙 夜猫子：凌晨0-5点发言3次
-- 🐦 早起鸟：早上6-8点发言3次
-"""
\ No newline at end of file
+{rules}
+"""
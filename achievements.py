@@ -0,0 +1,335 @@
+# encoding:utf-8
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from operator import attrgetter
+
+from common.log import logger
+
+RULE_TYPES = ("daily_count", "hour_window", "streak", "meme_count")
+
+# 配置未提供 achievements 时使用的默认规则
+DEFAULT_ACHIEVEMENTS = {
+    "meme_lord": {"name": "🤪梗王", "desc": "原创梗被引用10次以上", "type": "meme_count", "condition": 10,
+                  "unit": "个"},
+    "water_king": {"name": "🏆水王", "desc": "单日发言超过50条", "type": "daily_count", "condition": 50,
+                   "unit": "条"},
+    "night_owl": {"name": "🌙夜猫子", "desc": "凌晨0-5点发言3次", "type": "hour_window", "hours": [0, 5],
+                  "condition": 3, "unit": "次"},
+    "early_bird": {"name": "🐦早起鸟", "desc": "早上6-8点发言3次", "type": "hour_window", "hours": [6, 8],
+                   "condition": 3, "unit": "次"},
+}
+
+
+def load_achievements(config):
+    """读取并校验配置中的成就规则，返回 {achievement_id: rule}，保持配置中的顺序"""
+    achievements = {}
+    for achievement_id, rule in ((config or {}).get("achievements") or DEFAULT_ACHIEVEMENTS).items():
+        rule = dict(rule)
+        if rule.get("type") not in RULE_TYPES:
+            raise ValueError(f"成就 {achievement_id} 的类型无效: {rule.get('type')}")
+        if not isinstance(rule.get("condition"), int) or rule["condition"] < 1:
+            raise ValueError(f"成就 {achievement_id} 的 condition 必须是正整数")
+        if rule["type"] == "hour_window":
+            start, end = rule.get("hours") or (None, None)
+            if not (isinstance(start, int) and isinstance(end, int) and 0 <= start < end <= 24):
+                raise ValueError(f"成就 {achievement_id} 的 hours 必须是 [开始小时, 结束小时)")
+            rule["hours"] = (start, end)
+        rule.setdefault("min_daily", 1)
+        rule.setdefault("name", achievement_id)
+        rule.setdefault("desc", "")
+        rule.setdefault("unit", "")
+        achievements[achievement_id] = rule
+    return achievements
+
+
+def _thresholds(items):
+    """[(condition, achievement_id)] -> (升序的 conditions, 对应的 ids)"""
+    items = sorted(items)
+    return [condition for condition, _ in items], [achievement_id for _, achievement_id in items]
+
+
+def _crossed(thresholds, old, new):
+    """计数从 old 增加到 new 时跨过的成就，即 old < condition <= new"""
+    conditions, ids = thresholds
+    return ids[bisect_right(conditions, old):bisect_right(conditions, new)]
+
+
+def _shift(date, days):
+    return (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _run_before(dates, date):
+    """截至 date 前一天的连续天数"""
+    run = 0
+    day = _shift(date, -1)
+    while day in dates:
+        run += 1
+        day = _shift(day, -1)
+    return run
+
+
+class AchievementEngine:
+    """成就状态机：已解锁集合、梗数和当天计数常驻内存，每条消息只做内存判断，真正解锁时才写库
+
+    规则按 type 编译成按阈值排序的表，每条消息只对各计数做一次“跨过了哪些阈值”的二分查找，
+    规则再多每条消息的开销也基本不变：
+    - daily_count：当天发言数达到 condition
+    - hour_window：当天 hours=[start, end) 时段内发言数达到 condition
+    - streak：连续 condition 天每天发言不少于 min_daily 条
+    - meme_count：原创梗被引用次数达到 condition
+    observe() 需在写入线程上、本批消息写入统计表之前调用，这样按天加载的计数不含本批，不会重复计数。
+    """
+
+    def __init__(self, achievements):
+        self.achievements = achievements
+        by_type = defaultdict(list)
+        windows = defaultdict(list)
+        streaks = defaultdict(list)
+        for achievement_id, rule in achievements.items():
+            if rule["type"] == "hour_window":
+                windows[rule["hours"]].append((rule["condition"], achievement_id))
+            elif rule["type"] == "streak":
+                streaks[rule["min_daily"]].append((rule["condition"], achievement_id))
+            else:
+                by_type[rule["type"]].append((rule["condition"], achievement_id))
+        self._daily_rules = _thresholds(by_type["daily_count"])
+        self._meme_rules = _thresholds(by_type["meme_count"])
+        self._streak_rules = {min_daily: _thresholds(items) for min_daily, items in streaks.items()}
+        self._streak_span = max((conditions[-1] for conditions, _ in self._streak_rules.values()), default=0)
+        # 每个小时只需检查包含它的时段
+        self._hour_rules = [[] for _ in range(24)]
+        for (start, end), items in windows.items():
+            for hour in range(start, end):
+                self._hour_rules[hour].append(((start, end), _thresholds(items)))
+        self.clear()
+
+    def clear(self):
+        """事务回滚后内存状态可能与库不一致，清空后按需重新加载"""
+        self._unlocked = None  # (group_id, user_id) -> {achievement_id}
+        self._meme_counts = None  # (group_id, user_id) -> 梗被引用次数
+        self._date = None
+        self._daily = {}  # (group_id, user_id) -> 当天发言数
+        self._hourly = {}  # (group_id, user_id) -> 当天每小时发言数
+        self._streaks = {}  # min_daily -> {(group_id, user_id): 截至昨天的连续天数}
+
+    def _load(self, conn):
+        self._unlocked = {}
+        for group_id, user_id, achievement_id in conn.execute(
+                "SELECT group_id, user_id, achievement_id FROM user_achievements"):
+            self._unlocked.setdefault((group_id, user_id), set()).add(achievement_id)
+        self._meme_counts = {(group_id, user_id): count for user_id, group_id, count in conn.execute(
+            "SELECT user_id, group_id, meme_count FROM user_meme_stats")}
+
+    def _roll(self, conn, date):
+        """切换到新的一天：从汇总表加载该日已有的计数和截至昨天的连续天数（通常只在启动后和跨天时各执行一次）"""
+        self._date = date
+        self._daily = {(group_id, user_id): count for group_id, user_id, count in conn.execute(
+            "SELECT group_id, user_id, count FROM daily_user_counts WHERE date = ?", (date,))}
+        self._hourly = {}
+        for group_id, user_id, hour, count in conn.execute(
+                "SELECT group_id, user_id, hour_group, count FROM hour_stats WHERE date = ?", (date,)):
+            self._hourly.setdefault((group_id, user_id), [0] * 24)[hour] = count
+        self._streaks = {}
+        for min_daily, (conditions, _) in self._streak_rules.items():
+            dates = defaultdict(set)
+            for group_id, user_id, day in conn.execute('''
+                    SELECT group_id, user_id, date FROM daily_user_counts
+                    WHERE date >= ? AND date < ? AND count >= ?
+                    ''', (_shift(date, -conditions[-1]), date, min_daily)):
+                dates[(group_id, user_id)].add(day)
+            self._streaks[min_daily] = {key: _run_before(days, date) for key, days in dates.items()}
+
+    def observe(self, conn, records):
+        """按消息时间逐条累加当天计数并判断消息类成就
+
+        只向后跨天：早于当前日期的迟到消息照常落库，但不再回到旧的一天重新加载计数，
+        否则新旧日期交替时每次切换都会丢掉内存中尚未落库的计数。这类成就可用 reevaluate-achievements 补发。
+        """
+        if self._unlocked is None:
+            self._load(conn)
+        for record in sorted(records, key=attrgetter("create_time")):
+            if record.date != self._date:
+                if self._date is not None and record.date < self._date:
+                    continue
+                self._roll(conn, record.date)
+            key = (record.other_user_id, record.actual_user_id)
+            old = self._daily.get(key, 0)
+            self._daily[key] = old + 1
+            self._check(conn, key, _crossed(self._daily_rules, old, old + 1), record.create_time)
+
+            hourly = self._hourly.get(key)
+            if hourly is None:
+                hourly = self._hourly[key] = [0] * 24
+            hourly[record.hour] += 1
+            for (start, end), thresholds in self._hour_rules[record.hour]:
+                count = sum(hourly[start:end])
+                self._check(conn, key, _crossed(thresholds, count - 1, count), record.create_time)
+
+            for min_daily, thresholds in self._streak_rules.items():
+                # 当天发言数刚达到 min_daily 时连续天数 +1
+                if old < min_daily <= old + 1:
+                    run = self._streaks[min_daily].get(key, 0)
+                    self._check(conn, key, _crossed(thresholds, run, run + 1), record.create_time)
+
+    def add_memes(self, conn, group_id, user_id, increment, create_time):
+        """原创者的梗被引用次数增加后判断梗类成就"""
+        if self._unlocked is None:
+            self._load(conn)
+        key = (group_id, user_id)
+        old = self._meme_counts.get(key, 0)
+        self._meme_counts[key] = old + increment
+        self._check(conn, key, _crossed(self._meme_rules, old, old + increment), create_time)
+
+    def _check(self, conn, key, achievement_ids, unlock_time):
+        for achievement_id in achievement_ids:
+            if achievement_id not in self._unlocked.get(key, ()):
+                self._grant(conn, key, achievement_id, unlock_time)
+
+    def _grant(self, conn, key, achievement_id, unlock_time):
+        group_id, user_id = key
+        conn.execute('''
+            INSERT OR IGNORE INTO user_achievements
+            (user_id, group_id, achievement_id, unlock_time)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, group_id, achievement_id, unlock_time))
+        self._unlocked.setdefault(key, set()).add(achievement_id)
+        logger.info(f"[GroupFun] {group_id} 的 {user_id} 解锁成就 {achievement_id}")
+
+    def progress(self, conn, group_id, user_id, date):
+        """一次查询取回用户的已解锁成就和各规则当前进度，返回 ({achievement_id}, {achievement_id: 数值})
+
+        直接读库，可在任意线程调用。按天计数只取连续天数规则需要的最近几天（没有该类规则时只取当天）。
+        """
+        unlocked, days, hourly, memes = set(), {}, [0] * 24, 0
+        for kind, name, value in conn.execute('''
+                SELECT 'a', achievement_id, 0 FROM user_achievements WHERE user_id = ? AND group_id = ?
+                UNION ALL
+                SELECT 'd', date, count FROM daily_user_counts
+                WHERE group_id = ? AND user_id = ? AND date > ? AND date <= ?
+                UNION ALL
+                SELECT 'h', hour_group, count FROM hour_stats WHERE user_id = ? AND group_id = ? AND date = ?
+                UNION ALL
+                SELECT 'm', '', meme_count FROM user_meme_stats WHERE user_id = ? AND group_id = ?
+                ''', (user_id, group_id,
+                      group_id, user_id, _shift(date, -max(self._streak_span, 1)), date,
+                      user_id, group_id, date,
+                      user_id, group_id)):
+            if kind == 'a':
+                unlocked.add(name)
+            elif kind == 'd':
+                days[name] = value
+            elif kind == 'h':
+                hourly[name] = value
+            else:
+                memes = value
+
+        progress = {}
+        for achievement_id, rule in self.achievements.items():
+            if rule["type"] == "daily_count":
+                progress[achievement_id] = days.get(date, 0)
+            elif rule["type"] == "hour_window":
+                progress[achievement_id] = sum(hourly[rule["hours"][0]:rule["hours"][1]])
+            elif rule["type"] == "meme_count":
+                progress[achievement_id] = memes
+            else:
+                active = {day for day, count in days.items() if count >= rule["min_daily"]}
+                progress[achievement_id] = _run_before(active, date) + (date in active)
+        return unlocked, progress
+
+    def evaluate_group(self, conn, group_id, unlock_time):
+        """按历史数据对一个群重新判断全部规则（规则变更后使用），只补发不收回，返回 {achievement_id: 新解锁人数}"""
+        qualified = defaultdict(set)
+        for achievement_id, rule in self.achievements.items():
+            if rule["type"] == "daily_count":
+                rows = conn.execute('''
+                    SELECT user_id FROM daily_user_counts WHERE group_id = ?
+                    GROUP BY user_id HAVING MAX(count) >= ?
+                ''', (group_id, rule["condition"]))
+            elif rule["type"] == "hour_window":
+                rows = conn.execute('''
+                    SELECT user_id FROM (
+                        SELECT user_id, SUM(count) AS total FROM hour_stats
+                        WHERE group_id = ? AND hour_group >= ? AND hour_group < ?
+                        GROUP BY user_id, date)
+                    GROUP BY user_id HAVING MAX(total) >= ?
+                ''', (group_id, rule["hours"][0], rule["hours"][1], rule["condition"]))
+            elif rule["type"] == "meme_count":
+                rows = conn.execute('''
+                    SELECT user_id FROM user_meme_stats WHERE group_id = ? AND meme_count >= ?
+                ''', (group_id, rule["condition"]))
+            else:
+                rows = self._streak_users(conn, group_id, rule)
+            qualified[achievement_id].update(user_id for user_id, in rows)
+
+        granted = {}
+        for achievement_id, users in qualified.items():
+            granted[achievement_id] = sum(conn.execute('''
+                INSERT OR IGNORE INTO user_achievements (user_id, group_id, achievement_id, unlock_time)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, group_id, achievement_id, unlock_time)).rowcount for user_id in sorted(users))
+        if any(granted.values()):
+            self.clear()
+        return granted
+
+    @staticmethod
+    def _streak_users(conn, group_id, rule):
+        """历史上最长连续天数达到 condition 的用户"""
+        users, run, previous = [], 0, None
+        for user_id, day in conn.execute('''
+                SELECT user_id, date FROM daily_user_counts WHERE group_id = ? AND count >= ?
+                ORDER BY user_id, date
+                ''', (group_id, rule["min_daily"])):
+            if previous and previous[0] == user_id and _shift(previous[1], 1) == day:
+                run += 1
+            else:
+                run = 1
+            previous = (user_id, day)
+            if run == rule["condition"]:
+                users.append((user_id,))
+        return users
+
+
+class ProgressCache:
+    """“我的成就”回复缓存：按 (group_id, user_id) 保存 ttl 秒，该用户有新消息入库后失效
+
+    失效与查询并发时（查询期间有新消息提交）不写入缓存，避免把旧结果存下来。
+    """
+
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}  # (group_id, user_id) -> (过期时间, 回复)
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回 (缓存的回复或 None, 当前版本号)，版本号用于 put"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1], self._epoch
+            return None, self._epoch
+
+    def put(self, key, epoch, value):
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            if len(self._entries) >= self.max_size:
+                self._entries = {k: entry for k, entry in self._entries.items() if entry[0] > now}
+                if len(self._entries) >= self.max_size:
+                    return
+            self._entries[key] = (now + self.ttl, value)
+
+    def invalidate(self, records):
+        """消息提交后调用，使发言人的缓存失效"""
+        with self._lock:
+            self._epoch += 1
+            if self._entries:
+                for record in records:
+                    self._entries.pop((record.other_user_id, record.actual_user_id), None)
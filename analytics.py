@@ -0,0 +1,113 @@
+# encoding:utf-8
+import threading
+from datetime import datetime, timedelta
+
+WEEKDAYS = "一二三四五六日"
+HEAT_LEVELS = "·░▒▓█"
+SPARKS = "▁▂▃▄▅▆▇█"
+
+
+def _empty_grid():
+    return [[0] * 24 for _ in range(7)]
+
+
+def _add(grid, other):
+    return [[a + b for a, b in zip(row, other_row)] for row, other_row in zip(grid, other)]
+
+
+def _scale(value, peak, levels):
+    """把 0..peak 映射到 levels 中的字符，非零值至少取第二档"""
+    if not value or not peak:
+        return levels[0]
+    return levels[max(1, min(len(levels) - 1, round(value * (len(levels) - 1) / peak)))]
+
+
+class ActivityAnalytics:
+    """基于 hour_stats 的活跃时段统计
+
+    按 (星期, 小时) 的聚合在 SQLite 中用一条 GROUP BY 完成，不逐行在 Python 里累加。
+    每个群过去 days 天（不含今天）的结果按天缓存，今天的部分每次单独查询后叠加，
+    所以报表当天内保持实时，重的聚合每群每天只做一次。查询按群路由到所在分片（见 ShardRouter），
+    走只读连接池（见 Database.reader）。
+    """
+
+    def __init__(self, shards, days=30):
+        self.shards = shards
+        self.days = days
+        self._cache = {}  # group_id -> (今天的日期, 过去 days 天的 7x24 网格)
+        self._lock = threading.Lock()
+
+    def _grid(self, conn, group_id, start, end):
+        """[start, end) 日期范围内按 (星期一=0.., 小时) 汇总的发言数"""
+        grid = _empty_grid()
+        for weekday, hour, count in conn.execute('''
+                SELECT (CAST(strftime('%w', date) AS INTEGER) + 6) % 7, hour_group, SUM(count)
+                FROM hour_stats
+                WHERE group_id = ? AND date >= ? AND date < ?
+                GROUP BY 1, 2
+                ''', (group_id, start, end)):
+            grid[weekday][hour] = count
+        return grid
+
+    def group_grid(self, group_id, today=None):
+        """近 days 天（含今天）的 7x24 发言网格"""
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            cached = self._cache.get(group_id)
+        tomorrow = (datetime.strptime(today, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        with self.shards.db(group_id).reader() as conn:
+            if cached is None or cached[0] != today:
+                start = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=self.days - 1)).strftime('%Y-%m-%d')
+                cached = (today, self._grid(conn, group_id, start, today))
+                with self._lock:
+                    self._cache[group_id] = cached
+            return _add(cached[1], self._grid(conn, group_id, today, tomorrow))
+
+    def heatmap(self, group_id):
+        grid = self.group_grid(group_id)
+        peak = max(max(row) for row in grid)
+        if not peak:
+            return "本群还没有发言记录哦~"
+        lines = [f"【本群活跃热力图🔥】近{self.days}天", "     0     6     12    18   23"]
+        for weekday, row in enumerate(grid):
+            lines.append(f"周{WEEKDAYS[weekday]} " + "".join(_scale(count, peak, HEAT_LEVELS) for count in row))
+        lines.append(f"{HEAT_LEVELS[0]}无 {HEAT_LEVELS[1]}少 → {HEAT_LEVELS[-1]}多（最高 {peak} 条/小时）")
+        return "\n".join(lines)
+
+    def peak_hours(self, group_id, top_n=3):
+        grid = self.group_grid(group_id)
+        hours = [sum(row[hour] for row in grid) for hour in range(24)]
+        total = sum(hours)
+        if not total:
+            return "本群还没有发言记录哦~"
+        weekdays = [sum(row) for row in grid]
+        ranked = sorted(range(24), key=lambda hour: hours[hour], reverse=True)
+        lines = [f"【本群高峰时段⏰】近{self.days}天共 {total} 条"]
+        for i, hour in enumerate([hour for hour in ranked[:top_n] if hours[hour]], 1):
+            lines.append(f"{i}. {hour:02d}:00-{hour + 1:02d}:00  {hours[hour]}条 ({hours[hour] * 100 / total:.1f}%)")
+        busiest = max(range(7), key=lambda weekday: weekdays[weekday])
+        quietest = min(range(24), key=lambda hour: hours[hour])
+        lines.append(f"最活跃: 周{WEEKDAYS[busiest]}  最安静: {quietest:02d}:00-{quietest + 1:02d}:00")
+        return "\n".join(lines)
+
+    def user_profile(self, group_id, user_id, nickname=None):
+        """个人近 days 天的 24 小时发言分布，走 hour_stats 主键 (user_id, group_id, ...)"""
+        start = (datetime.now() - timedelta(days=self.days - 1)).strftime('%Y-%m-%d')
+        hours = [0] * 24
+        with self.shards.db(group_id).reader() as conn:
+            for hour, count in conn.execute('''
+                    SELECT hour_group, SUM(count) FROM hour_stats
+                    WHERE user_id = ? AND group_id = ? AND date >= ?
+                    GROUP BY hour_group
+                    ''', (user_id, group_id, start)):
+                hours[hour] = count
+        total = sum(hours)
+        if not total:
+            return "你最近还没有发言记录哦~"
+        peak = max(hours)
+        ranked = sorted(range(24), key=lambda hour: hours[hour], reverse=True)[:3]
+        lines = [f"【{nickname or '我'}的活跃时段📊】近{self.days}天共 {total} 条",
+                 "".join(_scale(count, peak, SPARKS) if count else " " for count in hours),
+                 "0     6     12    18   23",
+                 "最常出没: " + "、".join(f"{hour:02d}点({hours[hour]}条)" for hour in ranked if hours[hour])]
+        return "\n".join(lines)
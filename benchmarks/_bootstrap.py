@@ -0,0 +1,155 @@
+# encoding:utf-8
+"""让基准脚本脱离机器人框架独立运行：按需补上框架模块，并把插件目录注册为 GroupFun 包"""
+import importlib
+import json
+import logging
+import os
+import sys
+import types
+from enum import Enum
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _ensure_logger():
+    try:
+        importlib.import_module("common.log")
+    except ImportError:
+        common = sys.modules.setdefault("common", types.ModuleType("common"))
+        log = types.ModuleType("common.log")
+        log.logger = logging.getLogger("GroupFun.bench")
+        common.log = log
+        sys.modules["common.log"] = log
+
+
+def load(module, plugin_dir=PLUGIN_DIR):
+    """加载插件子模块，例如 load("schema")；不会执行包的 __init__.py
+
+    plugin_dir 可指向插件代码的副本（负载基准在临时目录里运行插件，数据库随之建在副本目录下）。
+    """
+    _ensure_logger()
+    if "GroupFun" not in sys.modules:
+        package = types.ModuleType("GroupFun")
+        package.__path__ = [plugin_dir]
+        sys.modules["GroupFun"] = package
+    return importlib.import_module(f"GroupFun.{module}")
+
+
+# 以下为框架桩：只实现插件用到的接口，行为与 dow 框架一致
+
+
+class ContextType(Enum):
+    TEXT = 1
+    VOICE = 2
+    IMAGE = 3
+
+
+class Context:
+    def __init__(self, type=None, content=None, kwargs=None):
+        self.type = type
+        self.content = content
+        self.kwargs = kwargs or {}
+
+    def __getitem__(self, key):
+        return self.kwargs[key]
+
+    def __setitem__(self, key, value):
+        self.kwargs[key] = value
+
+    def get(self, key, default=None):
+        return self.kwargs.get(key, default)
+
+
+class ReplyType(Enum):
+    TEXT = 1
+    ERROR = 10
+
+
+class Reply:
+    def __init__(self, type=None, content=None):
+        self.type = type
+        self.content = content
+
+
+class ChatMessage:
+    def __init__(self, **fields):
+        self.is_group = True
+        self.__dict__.update(fields)
+
+
+class Event(Enum):
+    ON_RECEIVE_MESSAGE = 1
+    ON_HANDLE_CONTEXT = 2
+
+
+class EventAction(Enum):
+    CONTINUE = 1
+    BREAK = 2
+    BREAK_PASS = 3
+
+
+class EventContext:
+    def __init__(self, event, econtext=None):
+        self.event = event
+        self.econtext = econtext or {}
+        self.action = EventAction.CONTINUE
+
+    def __getitem__(self, key):
+        return self.econtext[key]
+
+    def __setitem__(self, key, value):
+        self.econtext[key] = value
+
+
+class Plugin:
+    def __init__(self):
+        self.handlers = {}
+
+    def _read_json(self, name):
+        path = os.path.join(self.path, name)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def load_config(self):
+        return self._read_json("config.json")
+
+    def _load_config_template(self):
+        return self._read_json("config.json.template")
+
+    def get_help_text(self, **kwargs):
+        return ""
+
+
+def register(name, desire_priority=0, **kwargs):
+    def wrapper(cls):
+        cls.name = name
+        cls.priority = desire_priority
+        cls.version = kwargs.get("version")
+        cls.path = os.path.dirname(sys.modules[cls.__module__].__file__)
+        return cls
+    return wrapper
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules.setdefault(parent, types.ModuleType(parent)), child, module)
+    return module
+
+
+def stub_framework():
+    """总是换成桩模块（plugins、bridge.context、bridge.reply、channel.chat_message），结果与框架版本无关"""
+    _ensure_logger()
+    exports = {"Event": Event, "EventAction": EventAction, "EventContext": EventContext, "Plugin": Plugin,
+               "register": register}
+    _module("plugins", __all__=list(exports), **exports)
+    _module("bridge")
+    _module("bridge.context", Context=Context, ContextType=ContextType)
+    _module("bridge.reply", Reply=Reply, ReplyType=ReplyType)
+    _module("channel")
+    _module("channel.chat_message", ChatMessage=ChatMessage)
@@ -0,0 +1,148 @@
+# encoding:utf-8
+"""chat_records 索引迁移耗时，以及迁移后每条消息的写入热路径耗时
+
+用法: python benchmarks/bench_chat_records_index.py [--rows 1000000] [--samples 200]
+在旧结构(v0，无索引)上生成数据，逐个版本执行迁移并分别计时（index_migrate_seconds 只含 v2 的加列和建索引），
+然后测量每条消息在写入线程上触发的查询：梗候选点查（meme_candidates）和时段/按天汇总的增量更新。
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _bootstrap  # noqa: E402
+
+schema = _bootstrap.load("schema")
+memes = _bootstrap.load("memes")
+
+# 与插件写入批次中的语句一致（MemeTracker._load、update_hour_stats、update_daily_counts）
+HOT_QUERIES = [
+    ("meme_candidate", '''
+        SELECT content, norm_text, simhash, first_user_id, first_nickname, first_time, user_ids, promoted
+        FROM meme_candidates WHERE group_id = ? AND meme_key = ?'''),
+    ("hour_stats", '''
+        INSERT INTO hour_stats (user_id, group_id, hour_group, count, date) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(user_id, group_id, hour_group, date) DO UPDATE SET count = count + excluded.count'''),
+    ("daily_user_counts", '''
+        INSERT INTO daily_user_counts (group_id, date, user_id, count, user_nickname) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(group_id, date, user_id)
+        DO UPDATE SET count = count + excluded.count, user_nickname = excluded.user_nickname'''),
+]
+
+
+def build(path, rows, groups, users, days, seed):
+    rnd = random.Random(seed)
+    vocabulary = [f"梗{i}" for i in range(2000)]
+    now = datetime.now()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute('''
+        CREATE TABLE chat_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT NOT NULL,
+            user_nickname TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            content TEXT,
+            create_time TEXT NOT NULL,
+            hour_group INTEGER
+        )''')
+
+    def generate():
+        for i in range(rows):
+            ts = now - timedelta(seconds=rnd.randrange(days * 86400))
+            user = rnd.randrange(users)
+            content = rnd.choice(vocabulary) if rnd.random() < 0.3 else f"消息{i}"
+            yield (f"group{rnd.randrange(groups)}", f"nick{user}", f"user{user}", content,
+                   ts.strftime('%Y-%m-%d %H:%M:%S'), ts.hour)
+
+    conn.executemany('''
+        INSERT INTO chat_records (group_id, user_nickname, user_id, content, create_time, hour_group)
+        VALUES (?, ?, ?, ?, ?, ?)''', generate())
+    conn.commit()
+    return conn, vocabulary
+
+
+def migrate(conn):
+    """与 schema.migrate 相同，但每个版本单独计时"""
+    seconds = {}
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    for target, step in schema.MIGRATIONS:
+        start = time.perf_counter()
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {target}")
+        seconds[f"v{target}"] = round(time.perf_counter() - start, 2)
+    conn.execute("COMMIT")
+    return seconds
+
+
+def sample_messages(count, groups, users, vocabulary, seed):
+    rnd = random.Random(seed + 1)
+    now = datetime.now()
+    return [(f"group{rnd.randrange(groups)}", f"user{rnd.randrange(users)}", rnd.choice(vocabulary),
+             now.strftime('%Y-%m-%d'), now.hour) for _ in range(count)]
+
+
+def measure(conn, messages):
+    """每条消息一个写事务，与写入线程逐条落盘时相同"""
+    latencies = []
+    for group_id, user_id, content, date, hour in messages:
+        params = {
+            "meme_candidate": (group_id, memes.meme_key(content)),
+            "hour_stats": (user_id, group_id, hour, date),
+            "daily_user_counts": (group_id, date, user_id, "nick"),
+        }
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        for name, sql in HOT_QUERIES:
+            conn.execute(sql, params[name]).fetchall()
+        conn.execute("COMMIT")
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        "avg_ms": round(sum(latencies) / len(latencies), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        start = time.perf_counter()
+        conn, vocabulary = build(path, args.rows, args.groups, args.users, args.days, args.seed)
+        build_seconds = time.perf_counter() - start
+
+        migrate_seconds = migrate(conn)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        hot_path = measure(conn, sample_messages(args.samples, args.groups, args.users, vocabulary, args.seed))
+        conn.close()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "samples": args.samples,
+        "build_seconds": round(build_seconds, 2),
+        "index_migrate_seconds": migrate_seconds["v2"],
+        "migrate_seconds": migrate_seconds,
+        "hot_path": hot_path,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
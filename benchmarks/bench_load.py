@@ -0,0 +1,273 @@
+# encoding:utf-8
+"""整个插件的端到端负载基准：用框架桩驱动 on_receive_message / on_handle_context
+
+用法: python benchmarks/bench_load.py [--messages 20000] [--message-rate 0] [--groups 20] [--users 500] [--repeat-rate 0.2] [--long-rate 0]
+                                      [--db-rows 0] [--config 覆盖配置.json] [--output 结果.json]
+把插件代码复制到临时目录运行（不碰插件目录下的数据库），先按 --db-rows 用导入器灌入过去 --days 天的历史，
+再按顺序发送合成的群消息，每条消息依次经过两个事件处理函数，期间按 --command-rate 穿插查询命令；
+--burst-threads 个线程在发送期间各以每秒 --burst-rate 次执行查询命令（模拟多个群同时查榜，0 为不限速），
+用于观察读对写入的影响；
+消息全部落盘后再对每个命令单独采样。结果以 JSON 输出，同一参数和 --seed 下可在不同版本之间对比。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import _bootstrap  # noqa: E402
+
+COMMANDS = ["今日水王", "本周水王", "本月水王", "梗排行榜", "我的成就", "活跃热力图", "高峰时段", "我的活跃时段"]
+
+# 重复消息（梗）取自每群一个小词表，其余为各不相同的普通消息
+PHRASES = ["哈哈哈哈", "666", "绝绝子", "笑死", "yyds", "离谱", "破防了", "蚌埠住了", "好家伙", "🐶"]
+
+
+def summary(latencies):
+    if not latencies:
+        return {"count": 0}
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        "avg_ms": round(sum(latencies) / len(latencies), 3),
+        "max_ms": round(latencies[-1], 3),
+    }
+
+
+class Traffic:
+    """合成群聊流量：用户发言量按排名呈长尾分布，repeat_rate 比例的消息取自群内流行语，
+    long_rate 比例为分享链接、转发文章之类的长消息"""
+
+    def __init__(self, groups, users, repeat_rate, seed, long_rate=0.0):
+        self.rnd = random.Random(seed)
+        self.groups = [f"group{i}" for i in range(groups)]
+        self.users = [f"user{i}" for i in range(users)]
+        self.weights = [1 / (rank + 1) for rank in range(users)]
+        self.repeat_rate = repeat_rate
+        self.long_rate = long_rate
+        self.count = 0
+
+    def next(self):
+        self.count += 1
+        group = self.rnd.choice(self.groups)
+        user = self.rnd.choices(self.users, self.weights)[0]
+        roll = self.rnd.random()
+        if roll < self.repeat_rate:
+            content = self.rnd.choice(PHRASES) + group[-1] * self.rnd.randrange(2)
+        elif roll < self.repeat_rate + self.long_rate:
+            content = f"第{self.count}条分享：" + "长消息正文" * self.rnd.randrange(20, 200)
+        else:
+            content = f"第{self.count}条消息" + "啊" * self.rnd.randrange(30)
+        return group, user, content
+
+
+def prefill(plugin_dir, config, rows, traffic, days):
+    """用导入器灌入过去 days 天的历史消息（不含今天），并重建统计、梗和成就"""
+    achievements = _bootstrap.load("achievements")
+    importer = _bootstrap.load("importer")
+    schema = _bootstrap.load("schema")
+    shards = _bootstrap.load("shards")
+    router = shards.ShardRouter(os.path.join(plugin_dir, "fun_center.db"), config.get("shards", 1),
+                                importer.BULK_PRAGMAS, partition_by_month=config.get("partition_by_month", False),
+                                achievements=achievements.load_achievements(config))
+    for shard in router:
+        with shard.db.transaction() as conn:
+            schema.migrate(conn)
+    importers = [importer.HistoryImporter(shard.db, partitions=shard.partitions, engine=shard.achievements)
+                 for shard in router]
+    now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def generate():
+        for _ in range(rows):
+            group, user, content = traffic.next()
+            ts = now - timedelta(seconds=traffic.rnd.randrange(1, days * 86400))
+            yield {"group_id": group, "user_id": user, "user_nickname": "昵称" + user, "content": content,
+                   "create_time": ts.strftime('%Y-%m-%d %H:%M:%S')}
+
+    for record in importer.iter_records(generate()):
+        importers[shards.shard_of(record[0], len(importers))].add(record)
+    for item in importers:
+        item.flush()
+        item.restore_indexes()
+        item.rebuild(config.get("meme_fuzzy_distance", 0))
+    router.close_all()
+
+
+def db_bytes(directory):
+    """插件目录下所有数据库文件（含分片、按月分区和 WAL）的总大小"""
+    total = 0
+    for root, _, files in os.walk(directory):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files
+                     if name.endswith((".db", ".db-wal", ".db-shm")))
+    return total
+
+
+def drain(plugin, timeout=120):
+    """等待写入队列把已入队的消息全部处理完"""
+    if not plugin.writer:
+        return
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = plugin.writer.stats()
+        if stats["depth"] == 0 and stats["flushed"] + stats["failed"] >= stats["enqueued"] - stats["dropped"]:
+            return
+        time.sleep(0.005)
+
+
+def context(group, user, content, event):
+    msg = _bootstrap.ChatMessage(other_user_id=group, actual_user_id=user, actual_user_nickname="昵称" + user,
+                                 content=content, is_group=True)
+    ctx = _bootstrap.Context(_bootstrap.ContextType.TEXT, content, {"msg": msg, "isgroup": True})
+    return _bootstrap.EventContext(event, {"context": ctx})
+
+
+def run_command(plugin, group, user, command):
+    e_context = context(group, user, command, _bootstrap.Event.ON_HANDLE_CONTEXT)
+    start = time.perf_counter()
+    plugin.on_handle_context(e_context)
+    return (time.perf_counter() - start) * 1000
+
+
+def burst(plugin, groups, users, rate, stop, latencies, seed):
+    """查询风暴：每秒 rate 次在随机群执行随机命令，直到 stop 被设置"""
+    rnd = random.Random(seed)
+    interval = 1 / rate if rate > 0 else 0
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        latencies.append(run_command(plugin, rnd.choice(groups), rnd.choice(users), rnd.choice(COMMANDS)))
+        next_at += interval
+        stop.wait(max(0, next_at - time.perf_counter()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="实时发送的消息数")
+    parser.add_argument("--message-rate", type=float, default=0, help="每秒发送的消息数，0 为尽快发送（测吞吐）")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--repeat-rate", type=float, default=0.2, help="取自流行语的重复消息比例")
+    parser.add_argument("--long-rate", type=float, default=0.0, help="超过50字的长消息比例")
+    parser.add_argument("--db-rows", type=int, default=0, help="预先灌入的历史消息数，决定库的大小")
+    parser.add_argument("--days", type=int, default=30, help="历史消息分布的天数")
+    parser.add_argument("--command-rate", type=float, default=0.005, help="发送消息期间穿插查询命令的比例")
+    parser.add_argument("--burst-threads", type=int, default=0, help="发送期间持续执行查询命令的线程数")
+    parser.add_argument("--burst-rate", type=float, default=50, help="每个查询线程每秒执行的命令数，0 为不限速")
+    parser.add_argument("--command-samples", type=int, default=50, help="落盘后每个命令的采样次数")
+    parser.add_argument("--config", help="覆盖插件默认配置的 JSON 文件（如关闭写入队列、开启分片）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    _bootstrap.stub_framework()
+    with tempfile.TemporaryDirectory() as tmp:
+        plugin_dir = os.path.join(tmp, "GroupFun")
+        shutil.copytree(_bootstrap.PLUGIN_DIR, plugin_dir,
+                        ignore=shutil.ignore_patterns("benchmarks", "doc", ".git", "*.db*", "chat_partitions",
+                                                      "shard_*", "config.json", "__pycache__"))
+        with open(os.path.join(plugin_dir, "config.json.template"), encoding="utf-8") as f:
+            config = json.load(f)
+        # 后台清理会在运行中途启动，干扰测量
+        config["retention"] = dict(config.get("retention") or {}, enabled=False)
+        if args.config:
+            with open(args.config, encoding="utf-8") as f:
+                config.update(json.load(f))
+        with open(os.path.join(plugin_dir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False)
+
+        _bootstrap.load("schema", plugin_dir)
+        traffic = Traffic(args.groups, args.users, args.repeat_rate, args.seed, args.long_rate)
+        start = time.perf_counter()
+        if args.db_rows:
+            prefill(plugin_dir, config, args.db_rows, traffic, args.days)
+        prefill_seconds = time.perf_counter() - start
+        size_before = db_bytes(plugin_dir)
+
+        start = time.perf_counter()
+        plugin = _bootstrap.load("GroupFun").GroupFun()
+        init_seconds = time.perf_counter() - start
+        # 迁移在后台进行，就绪后再开始发送，避免把启动时间算进消息耗时
+        plugin.db_ready.wait(600)
+        ready_seconds = time.perf_counter() - start
+
+        rnd = random.Random(args.seed + 1)
+        message_latencies = []
+        live = {command: [] for command in COMMANDS}
+        stop, burst_latencies = threading.Event(), []
+        threads = [threading.Thread(target=burst, daemon=True,
+                                    args=(plugin, traffic.groups, traffic.users, args.burst_rate, stop,
+                                          burst_latencies, args.seed + 2 + i))
+                   for i in range(args.burst_threads)]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        interval = 1 / args.message_rate if args.message_rate > 0 else 0
+        for i in range(args.messages):
+            if interval:
+                time.sleep(max(0, start + i * interval - time.perf_counter()))
+            group, user, content = traffic.next()
+            received = context(group, user, content, _bootstrap.Event.ON_RECEIVE_MESSAGE)
+            handled = context(group, user, content, _bootstrap.Event.ON_HANDLE_CONTEXT)
+            # 框架对每条消息依次触发两个事件，两者之和才是插件给每条消息增加的耗时
+            t = time.perf_counter()
+            plugin.on_receive_message(received)
+            plugin.on_handle_context(handled)
+            message_latencies.append((time.perf_counter() - t) * 1000)
+            if rnd.random() < args.command_rate:
+                command = rnd.choice(COMMANDS)
+                live[command].append(run_command(plugin, group, user, command))
+        sent_seconds = time.perf_counter() - start
+        drain(plugin)
+        ingest_seconds = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        idle = {command: [run_command(plugin, rnd.choice(traffic.groups), rnd.choice(traffic.users), command)
+                          for _ in range(args.command_samples)] for command in COMMANDS}
+        writer = plugin.writer.stats() if plugin.writer else None
+        stages = plugin.metrics.snapshot().get("stage", {})
+        plugin.close()
+        size_after = db_bytes(plugin_dir)
+
+    result = {
+        "plugin_version": plugin.version,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "prefill_seconds": round(prefill_seconds, 2),
+        "init_seconds": round(init_seconds, 3),
+        "ready_seconds": round(ready_seconds, 3),
+        "messages": {
+            "latency": summary(message_latencies),
+            "send_seconds": round(sent_seconds, 3),
+            # 含等待写入队列落盘的时间
+            "seconds": round(ingest_seconds, 3),
+            "msgs_per_sec": round(args.messages / max(ingest_seconds, 1e-9), 1),
+        },
+        "db_bytes": {"before": size_before, "after": size_after},
+        "commands": {command: {"live": summary(live[command]), "idle": summary(idle[command])}
+                     for command in COMMANDS},
+        "burst": summary(burst_latencies),
+        "writer": writer,
+        # 插件自身记录的各处理阶段耗时（毫秒）
+        "stages": stages,
+    }
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# encoding:utf-8
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from common.log import logger
+from .partitions import month_range
+from .storage import day_number
+
+
+class Compactor:
+    """后台数据清理：按小批次删除过期数据，每批一个短事务，批次之间让出写锁
+
+    chat_records、hour_stats、daily_user_counts 按群走 (group_id, 时间) 索引分批删除，未成梗的过期候选和
+    紧凑存储中不再使用的正文各走自己的时间索引，每批都不扫描整表；最后做 WAL checkpoint，
+    库为 auto_vacuum=INCREMENTAL 时再回收空闲页。
+    启用按月分区时，整月过期的分区文件直接删除。
+    """
+
+    def __init__(self, db, max_record_days, batch_size=5000, interval_minutes=60, pause_ms=20,
+                 write_lock=None, on_memes_pruned=None, partitions=None):
+        self.db = db
+        self.partitions = partitions
+        self.max_record_days = max_record_days
+        self.batch_size = max(1, batch_size)
+        self.interval = interval_minutes * 60
+        self.pause = pause_ms / 1000
+        # 清理梗候选时需与写入线程互斥，并让其丢弃内存中的候选
+        self.write_lock = write_lock or threading.Lock()
+        self.on_memes_pruned = on_memes_pruned
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+
+    def start(self, delay_seconds=10):
+        self._thread = threading.Thread(target=self._run, args=(delay_seconds,), name="GroupFun-compactor",
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+
+    def _run(self, delay):
+        if self._stop.wait(delay):
+            return
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"[GroupFun] 数据清理异常: {e}", exc_info=True)
+            if self._stop.wait(self.interval):
+                return
+
+    def cutoff(self):
+        return (datetime.now() - timedelta(days=self.max_record_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def run_once(self, dry_run=False):
+        """执行一轮清理，返回各表删除（dry_run 时为将删除）的行数和耗时"""
+        start = time.perf_counter()
+        cutoff = self.cutoff()
+        cutoff_date = cutoff[:10]
+        report = {"cutoff": cutoff, "dry_run": dry_run}
+
+        if self.partitions:
+            report["chat_partitions"] = self.partitions.expired(cutoff)
+            if not dry_run:
+                report["partition_bytes"] = sum(self.partitions.drop(month) for month in report["chat_partitions"])
+
+        if dry_run:
+            conn = self.db.connection()
+            report["chat_records"] = self._count_by_group("chat_records", "create_time", cutoff)
+            report["hour_stats"] = self._count_by_group("hour_stats", "date", cutoff_date)
+            report["daily_user_counts"] = self._count_by_group("daily_user_counts", "date", cutoff_date)
+            report["meme_candidates"] = conn.execute(
+                "SELECT COUNT(*) FROM meme_candidates WHERE promoted = 0 AND last_time < ?",
+                (cutoff,)).fetchone()[0]
+            report["chat_contents"] = conn.execute(
+                "SELECT COUNT(*) FROM chat_contents WHERE last_day < ?",
+                (self._content_cutoff(cutoff, report.get("chat_partitions")),)).fetchone()[0]
+        else:
+            report["chat_records"] = self._delete_by_group("chat_records", '''
+                DELETE FROM chat_records WHERE id IN (
+                    SELECT id FROM chat_records WHERE group_id = ? AND create_time < ? LIMIT ?)''', cutoff)
+            report["hour_stats"] = self._delete_by_group("hour_stats", '''
+                DELETE FROM hour_stats WHERE rowid IN (
+                    SELECT rowid FROM hour_stats WHERE group_id = ? AND date < ? LIMIT ?)''', cutoff_date)
+            report["daily_user_counts"] = self._delete_by_group("daily_user_counts", '''
+                DELETE FROM daily_user_counts WHERE (group_id, date, user_id) IN (
+                    SELECT group_id, date, user_id FROM daily_user_counts WHERE group_id = ? AND date < ? LIMIT ?)''',
+                cutoff_date)
+            # 已成梗的候选保留，用于之后的引用计数；每批单独持写锁，批次之间的停顿不阻塞写入线程
+            report["meme_candidates"] = self._delete_batches('''
+                DELETE FROM meme_candidates WHERE rowid IN (
+                    SELECT rowid FROM meme_candidates WHERE promoted = 0 AND last_time < ? LIMIT ?)''', cutoff,
+                lock=self.write_lock, on_deleted=self.on_memes_pruned)
+            report["chat_contents"] = self._delete_batches('''
+                DELETE FROM chat_contents WHERE content_hash IN (
+                    SELECT content_hash FROM chat_contents WHERE last_day < ? LIMIT ?)''',
+                self._content_cutoff(cutoff))
+            report.update(self._reclaim())
+
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        self.last_report = report
+        logger.info(f"[GroupFun] 数据清理{'(演练)' if dry_run else ''}完成: {report}")
+        return report
+
+    def _content_cutoff(self, cutoff, expired=()):
+        """最后使用日早于该日的正文不再被任何保留的记录引用
+
+        分区整月删除，未整月过期的分区里还留有早于 cutoff 的记录，以最早保留分区的月初为界。
+        """
+        day = day_number(cutoff)
+        if self.partitions:
+            months = [month for month in self.partitions.months() if month not in (expired or ())]
+            if months:
+                day = min(day, day_number(month_range(months[0])[0]))
+        return day
+
+    def _groups(self, table):
+        """沿以 group_id 开头的索引逐个跳到下一个群，不扫描整表"""
+        conn = self.db.connection()
+        group_id = ""
+        while True:
+            row = conn.execute(
+                f"SELECT group_id FROM {table} WHERE group_id > ? ORDER BY group_id LIMIT 1",
+                (group_id,)).fetchone()
+            if row is None:
+                return
+            group_id = row[0]
+            yield group_id
+
+    def _count_by_group(self, table, column, cutoff):
+        conn = self.db.connection()
+        return sum(conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE group_id = ? AND {column} < ?",
+            (group_id, cutoff)).fetchone()[0] for group_id in self._groups(table))
+
+    def _delete_by_group(self, table, sql, cutoff):
+        """按群走 (group_id, 时间) 索引取出一批过期行再删除，每批只触及该群的过期行，不扫描整表
+
+        chat_records 补导入的历史记录 id 不连续也能删到。
+        """
+        removed = 0
+        for group_id in list(self._groups(table)):
+            while not self._stop.is_set():
+                with self.db.transaction() as conn:
+                    count = conn.execute(sql, (group_id, cutoff, self.batch_size)).rowcount
+                removed += count
+                if count < self.batch_size:
+                    break
+                time.sleep(self.pause)
+        return removed
+
+    def _delete_batches(self, sql, cutoff, lock=None, on_deleted=None):
+        """每批一个短事务；给了 lock 时只在删除该批（及 on_deleted 回调）期间持有"""
+        removed = 0
+        while not self._stop.is_set():
+            with lock or nullcontext():
+                with self.db.transaction() as conn:
+                    count = conn.execute(sql, (cutoff, self.batch_size)).rowcount
+                if count and on_deleted:
+                    on_deleted()
+            removed += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return removed
+
+    def _reclaim(self):
+        """WAL checkpoint 并按需增量回收空闲页"""
+        conn = self.db.connection()
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        result = {"checkpoint_pages": checkpointed, "wal_pages": log_pages}
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+            result["vacuum_pages"] = free_pages
+        return result
@@ -0,0 +1,138 @@
+# encoding:utf-8
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from common.log import logger
+
+# 每个连接建立时执行一次的PRAGMA，可通过配置 db_pragmas 覆盖
+DEFAULT_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",  # 只对新建的库生效，数据清理后可增量回收空闲页
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16000,  # 负数表示KB，约16MB
+    "temp_store": "MEMORY",
+}
+
+# 只对写连接有意义的PRAGMA，只读连接不设置
+_WRITE_PRAGMAS = ("auto_vacuum", "journal_mode")
+
+
+def pin_snapshot(conn):
+    """在已 BEGIN 的读事务中立即固定 WAL 快照（否则要到第一次读表时才固定）"""
+    conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+
+
+class Database:
+    """SQLite连接管理：每个线程复用一个长连接，PRAGMA只在建连时设置一次
+
+    查询命令另走 reader()：最多 read_pool_size 个只读连接组成的池，不随命令线程增多。
+    """
+
+    def __init__(self, path, pragmas=None, cached_statements=256, read_pool_size=4):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        # sqlite3模块按SQL文本缓存预编译语句，SQL保持字面量不变即可复用
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._readers = []  # 空闲的只读连接
+        self._read_slots = threading.BoundedSemaphore(max(1, read_pool_size))
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.pragmas.get("busy_timeout", 5000) / 1000,
+            isolation_level=None,  # 事务由 transaction() 显式控制
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        for name, value in self.pragmas.items():
+            if not (readonly and name in _WRITE_PRAGMAS):
+                conn.execute(f"PRAGMA {name}={value}")
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        with self._lock:
+            self._connections.append(conn)
+        logger.debug(f"[GroupFun] 新建数据库连接 {self.path}")
+        return conn
+
+    def connection(self):
+        """获取当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """写事务，同一线程内嵌套调用会并入最外层事务，只提交一次"""
+        conn = self.connection()
+        depth = self._local.depth
+        if depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if depth == 0 and conn.in_transaction:
+                conn.rollback()
+            raise
+        self._local.depth = depth
+        if depth == 0:
+            conn.commit()
+
+    @contextmanager
+    def reader(self):
+        """从只读连接池取一个连接，在一个读事务（WAL 快照）内执行查询
+
+        多条查询看到同一时刻的数据；WAL 下读不阻塞写，退出时结束读事务，不妨碍 checkpoint。
+        池中连接都在用时等待归还。
+        """
+        self._read_slots.acquire()
+        try:
+            with self._lock:
+                conn = self._readers.pop() if self._readers else None
+            if conn is None:
+                conn = self._connect(readonly=True)
+            try:
+                conn.execute("BEGIN")
+                yield conn
+            finally:
+                self._release_reader(conn)
+        finally:
+            self._read_slots.release()
+
+    def _release_reader(self, conn):
+        """结束读事务后放回池中（查询出错也要归还）；无法回滚的连接关闭丢弃，close_all 之后归还的也关闭"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        with self._lock:
+            if healthy and conn in self._connections:
+                self._readers.append(conn)
+                return
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def close_all(self):
+        """关闭所有线程的连接（插件卸载或删除数据库文件前调用）"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._readers = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"[GroupFun] 关闭数据库连接失败: {e}")
+        self._local = threading.local()
@@ -0,0 +1,270 @@
+# encoding:utf-8
+import csv
+import json
+import re
+from collections import defaultdict
+from datetime import datetime
+
+from common.log import logger
+from .memes import content_hash, meme_key, recompute_memes
+from .partitions import CHAT_RECORDS_INDEXES, month_of, resolved_view
+
+# 批量导入时使用的连接参数：导入直接写线上库，synchronous 保持 WAL 下安全的 NORMAL（OFF 断电可能损坏整个库）
+BULK_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -262144,  # 约256MB
+    "temp_store": "MEMORY",
+}
+
+# 导出文件中可能出现的字段名 -> chat_records 的列
+FIELD_ALIASES = {
+    "group_id": ("group_id", "group", "room_id", "other_user_id"),
+    "user_id": ("user_id", "sender_id", "actual_user_id"),
+    "user_nickname": ("user_nickname", "nickname", "sender", "actual_user_nickname"),
+    "content": ("content", "text", "message"),
+    "create_time": ("create_time", "time", "timestamp"),
+}
+
+
+_TIME_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+
+# 内容相同的消息（“哈哈哈”“666”等）很常见，两个哈希按内容缓存，超过上限清空以保持内存恒定
+_HASH_CACHE_SIZE = 100000
+
+
+def _field(row, name):
+    for alias in FIELD_ALIASES[name]:
+        value = row.get(alias)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _resolve_fields(row):
+    """按首行确定每个列实际使用的字段名，之后各行直接按名取值"""
+    return {name: next((alias for alias in aliases if row.get(alias) not in (None, "")), aliases[0])
+            for name, aliases in FIELD_ALIASES.items()}
+
+
+def _normalize_time(value):
+    """支持 'YYYY-MM-DD HH:MM:SS'、ISO 8601 和秒/毫秒级时间戳"""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.isdigit()):
+        value = float(value)
+        if value > 1e11:
+            value /= 1000
+        return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    value = str(value).strip().replace("T", " ")[:19]
+    if not _TIME_RE.match(value):
+        datetime.strptime(value, '%Y-%m-%d %H:%M:%S')  # 抛出格式错误
+    return value
+
+
+def iter_rows(path, fmt=None):
+    """逐行读取导出文件，内存占用与文件大小无关"""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def iter_records(rows, group_id=None, stats=None):
+    """导出行 -> chat_records 行元组，缺字段或时间无法解析的行跳过并计数"""
+    fields = None
+    hashes = {}
+    for row in rows:
+        if fields is None:
+            fields = _resolve_fields(row)
+        try:
+            create_time = _normalize_time(row.get(fields["create_time"]) or _field(row, "create_time"))
+            group = group_id or row.get(fields["group_id"]) or _field(row, "group_id")
+            user_id = row.get(fields["user_id"]) or _field(row, "user_id")
+            if not group or not user_id:
+                raise ValueError("缺少 group_id 或 user_id")
+        except (TypeError, ValueError, OSError, OverflowError):
+            if stats is not None:
+                stats["skipped"] += 1
+            continue
+        content = row.get(fields["content"])
+        if content is None:
+            content = _field(row, "content")
+        content = str(content) if content is not None else ""
+        nickname = row.get(fields["user_nickname"]) or _field(row, "user_nickname") or user_id
+        keys = hashes.get(content)
+        if keys is None:
+            if len(hashes) >= _HASH_CACHE_SIZE:
+                hashes.clear()
+            keys = hashes[content] = (content_hash(content), meme_key(content))
+        yield (str(group), str(nickname), str(user_id), content, keys[0], keys[1],
+               create_time, int(create_time[11:13]))
+
+
+class HistoryImporter:
+    """离线批量导入聊天记录：流式读取、分批事务写入 chat_records，最后一次性重建派生数据
+
+    导入期间只写聊天记录；时段统计和按天汇总在结束时按导入的 id 区间用 GROUP BY 汇总累加，
+    梗候选/梗词典/用户梗数整体重算一遍，成就按规则对涉及的群补发。
+    导入前为空的表（新部署的群或新月份分区）先删掉二级索引，写完后一次性重建，比逐行维护索引快得多。
+    可重复执行：与库中已有记录 (group_id, user_id, create_time, content_hash) 相同的行跳过；汇总起点记录在
+    import_progress 表中，重建完成后才删除，中断的导入重新执行时会把上次已写入的记录一并汇总。
+    """
+
+    def __init__(self, db, batch_size=50000, partitions=None, engine=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.partitions = partitions
+        self.engine = engine
+        self._start_ids = {}  # 分区月份（不分区时为 None）-> 汇总起点，即首次（可能已中断的）导入前该表的最大 id
+        self._existing_ids = {}  # 分区月份 -> 本次导入前该表的最大 id，不超过它的行参与去重
+        self._unindexed = set()  # 删掉了二级索引、导入完成后需重建的分区月份
+        self._batch = []
+        self.stats = {"imported": 0, "skipped": 0, "duplicates": 0}
+
+    def _table(self, month):
+        return f"{self.partitions.schema(month)}.chat_records" if month else "chat_records"
+
+    def _schema(self, month):
+        return self.partitions.schema(month) if month else "main"
+
+    def _write(self, conn, batch):
+        by_month = defaultdict(list)
+        for row in batch:
+            by_month[month_of(row[6]) if self.partitions else None].append(row)
+        if self.partitions:
+            # ATTACH 不能在事务内执行
+            self.partitions.attach(conn, by_month)
+        with self.db.transaction():
+            for month, rows in by_month.items():
+                table = self._table(month)
+                if month not in self._existing_ids:
+                    self._begin(conn, month)
+                existing = self._existing_ids[month]
+                if existing:
+                    # 只与导入前已有的行比较，同一文件内同一秒的重复发言照常导入
+                    inserted = conn.executemany(f'''
+                        INSERT INTO {table}
+                        (group_id, user_nickname, user_id, content, content_hash, meme_key, create_time, hour_group)
+                        SELECT ?, ?, ?, ?, ?, ?, ?, ?
+                        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE group_id = ? AND create_time = ?
+                                          AND user_id = ? AND content_hash = ? AND id <= ?)
+                    ''', [row + (row[0], row[6], row[2], row[4], existing) for row in rows]).rowcount
+                else:
+                    inserted = conn.executemany(f'''
+                        INSERT INTO {table}
+                        (group_id, user_nickname, user_id, content, content_hash, meme_key, create_time, hour_group)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', rows).rowcount
+                self.stats["imported"] += inserted
+                self.stats["duplicates"] += len(rows) - inserted
+
+    def _begin(self, conn, month):
+        """首次写入某张表时记录去重边界和汇总起点；表为空时删掉二级索引，否则确保去重查找用到的索引存在"""
+        table = self._table(month)
+        existing = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        self._existing_ids[month] = existing
+        row = conn.execute("SELECT start_id FROM import_progress WHERE month = ?", (month or "",)).fetchone()
+        if row:
+            self._start_ids[month] = row[0]
+        else:
+            self._start_ids[month] = existing
+            conn.execute("INSERT INTO import_progress (month, start_id) VALUES (?, ?)", (month or "", existing))
+        if not existing:
+            for name in CHAT_RECORDS_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {self._schema(month)}.{name}")
+            self._unindexed.add(month)
+        else:
+            # 上次导入中断在重建索引之前时索引可能还缺着
+            for ddl in CHAT_RECORDS_INDEXES.values():
+                conn.execute(ddl.format(schema=self._schema(month)))
+
+    def add(self, record):
+        """攒够 batch_size 条写入一次（多个分片各用一个导入器时逐条分发）"""
+        self._batch.append(record)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+            logger.info(f"[GroupFun] 已导入 {self.stats['imported']} 条")
+
+    def flush(self):
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._write(self.db.connection(), batch)
+
+    def load(self, records):
+        """分批写入聊天记录"""
+        for record in records:
+            self.add(record)
+        self.flush()
+
+    def restore_indexes(self):
+        """重建导入时删掉的索引；导入出错时也应调用"""
+        conn = self.db.connection()
+        for month in sorted(self._unindexed, key=lambda month: month or ""):
+            if month:
+                self.partitions.attach(conn, [month])
+            with self.db.transaction():
+                for ddl in CHAT_RECORDS_INDEXES.values():
+                    conn.execute(ddl.format(schema=self._schema(month)))
+        self._unindexed.clear()
+
+    def _rebuild_rollups(self, conn, table, start_id):
+        """把一张表中新导入的记录汇总累加到 hour_stats 和 daily_user_counts 并更新昵称，返回涉及的群"""
+        conn.execute(f'''
+            INSERT INTO hour_stats (user_id, group_id, hour_group, count, date)
+            SELECT user_id, group_id, hour_group, COUNT(*), substr(create_time, 1, 10)
+            FROM {table} WHERE id > ?
+            GROUP BY user_id, group_id, hour_group, substr(create_time, 1, 10)
+            ON CONFLICT(user_id, group_id, hour_group, date)
+            DO UPDATE SET count = count + excluded.count
+        ''', (start_id,))
+        # MAX(create_time) 让昵称取当天最后一条；库里已有的汇总行保留原昵称
+        conn.execute(f'''
+            INSERT INTO daily_user_counts (group_id, date, user_id, count, user_nickname)
+            SELECT group_id, date, user_id, count, user_nickname FROM (
+                SELECT group_id, substr(create_time, 1, 10) AS date, user_id, COUNT(*) AS count,
+                       user_nickname, MAX(create_time)
+                FROM {table} WHERE id > ?
+                GROUP BY group_id, substr(create_time, 1, 10), user_id)
+            WHERE true
+            ON CONFLICT(group_id, date, user_id)
+            DO UPDATE SET count = count + excluded.count
+        ''', (start_id,))
+        # 昵称取每人最后一条，比库里已有的更新时才覆盖
+        conn.execute(f'''
+            INSERT INTO user_profiles (group_id, user_id, nickname, updated_at)
+            SELECT group_id, user_id, user_nickname, MAX(create_time)
+            FROM {table} WHERE id > ?
+            GROUP BY group_id, user_id
+            ON CONFLICT(group_id, user_id)
+            DO UPDATE SET nickname = excluded.nickname, updated_at = excluded.updated_at
+            WHERE excluded.updated_at > user_profiles.updated_at
+        ''', (start_id,))
+        return {row[0] for row in conn.execute(f"SELECT DISTINCT group_id FROM {table} WHERE id > ?", (start_id,))}
+
+    def rebuild(self, fuzzy_distance=None):
+        """导入结束后重建派生数据，返回涉及的群"""
+        self.restore_indexes()
+        conn = self.db.connection()
+        # 本次没有写到、但上次中断的导入写过的表也要汇总
+        for month, start_id in conn.execute("SELECT month, start_id FROM import_progress").fetchall():
+            self._start_ids.setdefault(month or None, start_id)
+        groups = set()
+        for month, start_id in sorted(self._start_ids.items(), key=lambda item: item[0] or ""):
+            if month:
+                self.partitions.attach(conn, [month])
+            with self.db.transaction():
+                groups |= self._rebuild_rollups(conn, self._table(month), start_id)
+                conn.execute("DELETE FROM import_progress WHERE month = ?", (month or "",))
+        # 库里可能有紧凑存储的行，扫描还原正文和昵称后的视图
+        source = self.partitions.union_view(conn) if self.partitions else resolved_view(conn)
+        with self.db.transaction():
+            self.stats.update(recompute_memes(conn, fuzzy_distance, source))
+            if self.engine:
+                unlock_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                for group_id in sorted(groups):
+                    self.engine.evaluate_group(conn, group_id, unlock_time)
+        self.stats["groups"] = len(groups)
+        return groups
@@ -0,0 +1,163 @@
+# encoding:utf-8
+import heapq
+import threading
+import time
+
+from .db import pin_snapshot
+
+
+class _Board:
+    __slots__ = ("start", "end", "counts", "top", "loaded_at")
+
+    def __init__(self, start, end, counts):
+        self.start = start
+        self.end = end
+        self.counts = counts  # user_id -> [nickname, count]
+        self.top = None  # 缓存的 (n, 排行结果)，有新消息时失效
+        self.loaded_at = time.monotonic()
+
+
+class LeaderboardCache:
+    """水王榜缓存：按 (group_id, period) 保存本周期每人的发言数，随消息增量更新
+
+    首次查询时由 loader 在只读连接的快照上从按天汇总表加载，之后只在内存中累加；
+    周期起点变化（跨天/周/月）时自动失效重新加载。
+    max_age 秒不为空时榜单加载后最多使用这么久（单写者模式下写入发生在别的进程，本进程收不到 apply）。
+    """
+
+    def __init__(self, loader, reader, max_age=None):
+        self._loader = loader  # loader(conn, group_id, start, end) -> {user_id: [nickname, count]}
+        self._reader = reader  # reader(group_id) -> 只读连接的上下文管理器（见 Database.reader）
+        self.max_age = max_age
+        self._boards = {}
+        self._loading = []  # 加载中的 (group_id, start, end, 加载期间提交的消息)
+        self._today = None
+        self._lock = threading.Lock()
+        # 写入线程在“提交事务 + apply”期间持有；加载时只在固定读快照的一瞬间持有
+        self.commit_lock = threading.Lock()
+
+    @staticmethod
+    def _count(counts, record):
+        entry = counts.get(record.actual_user_id)
+        if entry is None:
+            counts[record.actual_user_id] = [record.actual_user_nickname, 1]
+        else:
+            entry[0] = record.actual_user_nickname
+            entry[1] += 1
+
+    def apply(self, records):
+        """把已提交的消息计入已加载的榜单"""
+        with self._lock:
+            if not (self._boards or self._loading) or not records:
+                return
+            if records[-1].date != self._today:
+                self._today = records[-1].date
+                self._expire(self._today)
+            for record in records:
+                for period in ("day", "week", "month"):
+                    board = self._boards.get((record.other_user_id, period))
+                    if board is None or not (board.start <= record.date < board.end):
+                        continue
+                    self._count(board.counts, record)
+                    board.top = None
+                for group_id, start, end, pending in self._loading:
+                    if group_id == record.other_user_id and start <= record.date < end:
+                        pending.append(record)
+
+    def _cached_top(self, key, start, n):
+        board = self._boards.get(key)
+        if board is None or board.start != start:
+            return None
+        if self.max_age is not None and time.monotonic() - board.loaded_at > self.max_age:
+            return None
+        if board.top is None or board.top[0] != n:
+            items = heapq.nlargest(n, board.counts.values(), key=lambda entry: entry[1])
+            board.top = (n, [(nickname, count) for nickname, count in items])
+        return board.top[1]
+
+    def top(self, group_id, period, start, end, n):
+        """返回 [(昵称, 发言数)]，按发言数降序取前 n 名"""
+        key = (group_id, period)
+        with self._lock:
+            result = self._cached_top(key, start, n)
+        if result is not None:
+            return result
+        with self._reader(group_id) as conn:
+            # 快照包含此前已提交并 apply 的全部消息，之后提交的由 apply 记入 pending，加载本身不阻塞写入
+            loading = (group_id, start, end, [])
+            with self.commit_lock:
+                pin_snapshot(conn)
+                with self._lock:
+                    self._loading.append(loading)
+            try:
+                counts = self._loader(conn, group_id, start, end)
+            except BaseException:
+                with self._lock:
+                    self._finish(loading)
+                raise
+        with self._lock:
+            self._finish(loading)
+            for record in loading[3]:
+                self._count(counts, record)
+            self._boards[key] = _Board(start, end, counts)
+            return self._cached_top(key, start, n)
+
+    def _finish(self, loading):
+        # 同一榜单可能并发加载，按对象而不是按值移除
+        self._loading = [item for item in self._loading if item is not loading]
+
+    def _expire(self, today):
+        """丢弃已经结束的周期"""
+        for key in [key for key, board in self._boards.items() if board.end <= today]:
+            del self._boards[key]
+
+    def invalidate(self, group_id=None):
+        with self._lock:
+            if group_id is None:
+                self._boards.clear()
+            else:
+                for period in ("day", "week", "month"):
+                    self._boards.pop((group_id, period), None)
+
+
+class ReplyCache:
+    """查询命令回复的短时缓存：每个键最多使用 max_age 秒（数据陈旧上限），0 表示不缓存
+
+    同一键的并发查询只有一个去读库，其余等待其结果，查询风暴时重的聚合每个群每 max_age 秒最多做一次。
+    """
+
+    def __init__(self, max_age=5, max_size=10000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self._entries = {}  # key -> (过期时间, 回复)
+        self._loading = {}  # key -> 加载完成的 Event
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        if self.max_age <= 0:
+            return load()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            event = self._loading.get(key)
+            if event is None:
+                self._loading[key] = threading.Event()
+        if event is not None:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            # 加载方出错时没有新结果，自己再查一次
+            return entry[1] if entry and entry[0] > time.monotonic() else load()
+        try:
+            value = load()
+            now = time.monotonic()
+            with self._lock:
+                if len(self._entries) >= self.max_size:
+                    self._entries = {k: item for k, item in self._entries.items() if item[0] > now}
+                if len(self._entries) < self.max_size:
+                    self._entries[key] = (now + self.max_age, value)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
@@ -0,0 +1,331 @@
+# encoding:utf-8
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+
+# 不同用户发送同一内容达到该人数即成梗
+MEME_THRESHOLD = 3
+
+# 连续三个及以上的相同字符折叠为两个，“哈哈哈哈”和“哈哈哈哈哈”视为同一内容
+_REPEAT_RE = re.compile(r"(.)\1{2,}", re.S)
+# 表情的变体选择符不属于标点/符号类别，单独去掉
+_VARIATION_SELECTORS = "\ufe0e\ufe0f"
+
+
+def content_hash(content):
+    """消息内容的64位哈希，存为有符号整数以便SQLite建索引"""
+    digest = hashlib.blake2b((content or "").encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def normalize_content(content):
+    """梗匹配用的归一化：NFKC（全角转半角）、小写、去掉空白/标点/表情符号、折叠重复字符
+
+    去掉后为空（纯标点或纯表情）时保留 NFKC 后的原文，避免所有表情包都归为同一个梗。
+    """
+    text = unicodedata.normalize("NFKC", content or "").lower()
+    folded = "".join(c for c in text
+                     if unicodedata.category(c)[0] not in "ZPSC" and c not in _VARIATION_SELECTORS)
+    return _REPEAT_RE.sub(r"\1\1", folded or "".join(text.split()))
+
+
+def meme_key(content):
+    """归一化内容的哈希，入库时计算一次并存入 chat_records.meme_key"""
+    return content_hash(normalize_content(content))
+
+
+def simhash(text):
+    """按字符二元组计算64位 SimHash，存为有符号整数"""
+    features = [text[i:i + 2] for i in range(len(text) - 1)] or [text]
+    weights = [0] * 64
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    value = sum(1 << bit for bit in range(64) if weights[bit] > 0)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def is_potential_meme(content):
+    """判断是否是潜在的梗消息"""
+    # 排除包含特定关键词的消息
+    exclude_keywords = ["梗", "水王", "成就"]
+    if any(keyword in content for keyword in exclude_keywords):
+        return False
+
+    # 短消息(小于50字符)或包含表情符号
+    return len(content) <= 50 or any(c in content for c in ["🤪", "😂", "🐶", "🐱"])
+
+
+class SimHashIndex:
+    """按群的 SimHash 近似去重索引
+
+    64位指纹切成 max_distance+1 段分桶，汉明距离不超过 max_distance 的两个指纹
+    必有一段完全相同，查找时只需比较同桶的候选。
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max(1, min(max_distance, 15))
+        self.bands = self.max_distance + 1
+        self.band_bits = 64 // self.bands
+        self._groups = {}  # group_id -> {(段序号, 段值): [(key, 指纹)]}
+
+    def _bands(self, value):
+        value &= (1 << 64) - 1
+        mask = (1 << self.band_bits) - 1
+        return [(band, value >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+    def has_group(self, group_id):
+        return group_id in self._groups
+
+    def load_group(self, group_id, items):
+        self._groups[group_id] = {}
+        for key, value in items:
+            self.add(group_id, key, value)
+
+    def add(self, group_id, key, value):
+        buckets = self._groups.get(group_id)
+        if buckets is None or value is None:
+            return
+        for band in self._bands(value):
+            buckets.setdefault(band, []).append((key, value))
+
+    def find(self, group_id, value):
+        """返回汉明距离最近且不超过 max_distance 的 key"""
+        buckets = self._groups.get(group_id) or {}
+        best, best_distance = None, self.max_distance + 1
+        for band in self._bands(value):
+            for key, other in buckets.get(band, ()):
+                distance = bin((value ^ other) & ((1 << 64) - 1)).count("1")
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        return best
+
+    def clear(self):
+        self._groups.clear()
+
+
+class MemeCandidate:
+    """梗候选：首次出现的用户/时间，以及用过该内容的不同用户集合"""
+
+    __slots__ = ("key", "content", "norm", "simhash", "first_user_id", "first_nickname", "first_time",
+                 "users", "promoted")
+
+    def __init__(self, key, content, norm, simhash, first_user_id, first_nickname, first_time, users,
+                 promoted=False):
+        self.key = key  # (group_id, meme_key)
+        self.content = content  # 首次出现时的原文，作为梗词典中的展示文本
+        self.norm = norm
+        self.simhash = simhash
+        self.first_user_id = first_user_id
+        self.first_nickname = first_nickname
+        self.first_time = first_time
+        self.users = users
+        self.promoted = promoted
+
+
+class MemeTracker:
+    """三人成梗候选跟踪，键为 (group_id, 归一化内容哈希)
+
+    前面是容量为 cache_size 的内存LRU，后面是 meme_candidates 表。热点候选的重复发言
+    不访问SQLite；只有出现新用户或新候选时才写一行。只能在写入事务内调用。
+    设置 fuzzy_distance 后，新内容会先在本群已有两人以上使用的候选中找 SimHash 近似项并归入其中。
+    """
+
+    def __init__(self, cache_size=5000, fuzzy_distance=None):
+        self.cache_size = max(1, cache_size)
+        self._cache = OrderedDict()
+        self.fuzzy = SimHashIndex(fuzzy_distance) if fuzzy_distance else None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, conn, key):
+        row = conn.execute('''
+            SELECT content, norm_text, simhash, first_user_id, first_nickname, first_time, user_ids, promoted
+            FROM meme_candidates WHERE group_id = ? AND meme_key = ?
+        ''', key).fetchone()
+        if row is None:
+            return None
+        content, norm, value, first_user_id, first_nickname, first_time, user_ids, promoted = row
+        users = set(user_ids.split(",")) if user_ids else set()
+        return MemeCandidate(key, content, norm, value, first_user_id, first_nickname, first_time, users,
+                             bool(promoted))
+
+    def _remember(self, key, candidate):
+        self._cache[key] = candidate
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _find_similar(self, conn, group_id, value):
+        """在本群近似索引中查找，索引按群懒加载"""
+        if not self.fuzzy.has_group(group_id):
+            rows = conn.execute('''
+                SELECT meme_key, simhash FROM meme_candidates WHERE group_id = ? AND user_count >= 2
+            ''', (group_id,)).fetchall()
+            self.fuzzy.load_group(group_id, rows)
+        match = self.fuzzy.find(group_id, value)
+        if match is None:
+            return None
+        return self._cache.get((group_id, match)) or self._load(conn, (group_id, match))
+
+    def _create(self, conn, key, record, norm, value):
+        candidate = MemeCandidate(key, record.content, norm, value, record.actual_user_id,
+                                  record.actual_user_nickname, record.create_time, {record.actual_user_id})
+        conn.execute('''
+            INSERT INTO meme_candidates
+            (group_id, meme_key, content, norm_text, simhash, first_user_id, first_nickname, first_time,
+             last_time, user_ids, user_count, promoted)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 0)
+        ''', key + (record.content, norm, value, record.actual_user_id, record.actual_user_nickname,
+                    record.create_time, record.create_time, record.actual_user_id))
+        return candidate
+
+    def observe(self, conn, key, record):
+        """记录一次发言，返回 (候选, 是否新用户)；哈希碰撞到不同内容时返回 (None, False)"""
+        candidate = self._cache.get(key)
+        if candidate is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.misses += 1
+            norm = normalize_content(record.content)
+            candidate = self._load(conn, key)
+            if candidate is not None and candidate.norm != norm:
+                return None, False
+            if candidate is None:
+                value = simhash(norm)
+                if self.fuzzy:
+                    candidate = self._find_similar(conn, key[0], value)
+                if candidate is None:
+                    candidate = self._create(conn, key, record, norm, value)
+                    self._remember(key, candidate)
+                    return candidate, True
+            # 近似命中时当前 key 也指向该候选，下次直接命中
+            self._remember(key, candidate)
+
+        if record.actual_user_id in candidate.users:
+            return candidate, False
+
+        candidate.users.add(record.actual_user_id)
+        if candidate.simhash is None and len(candidate.users) >= 2:
+            # 批量重算时只给两人以上用过的候选算指纹
+            candidate.simhash = simhash(candidate.norm)
+        conn.execute('''
+            UPDATE meme_candidates SET user_ids = ?, user_count = ?, last_time = ?, simhash = ?
+            WHERE group_id = ? AND meme_key = ?
+        ''', (",".join(candidate.users), len(candidate.users), record.create_time, candidate.simhash)
+            + candidate.key)
+        if self.fuzzy and len(candidate.users) == 2:
+            self.fuzzy.add(candidate.key[0], candidate.key[1], candidate.simhash)
+        return candidate, True
+
+    def mark_promoted(self, conn, candidate, creator, creator_id):
+        """标记为已成梗，原创者改为梗词典中记录的原创者（重新成梗的旧梗可能与候选的首位发送者不同）"""
+        candidate.promoted = True
+        candidate.first_nickname, candidate.first_user_id = creator, creator_id
+        conn.execute('''
+            UPDATE meme_candidates SET promoted = 1, first_nickname = ?, first_user_id = ?
+            WHERE group_id = ? AND meme_key = ?
+        ''', (creator, creator_id) + candidate.key)
+
+    def clear(self):
+        """事务回滚后内存状态可能与库不一致，清空后按需重新加载"""
+        self._cache.clear()
+        if self.fuzzy:
+            self.fuzzy.clear()
+
+
+def _flush_group(conn, group_id, candidates, aliases):
+    """写入一个群的重算结果，返回成梗数量"""
+    conn.executemany('''
+        INSERT INTO meme_candidates
+        (group_id, meme_key, content, norm_text, simhash, first_user_id, first_nickname, first_time,
+         last_time, user_ids, user_count, promoted)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (group_id, c.key[1], c.content, c.norm, c.simhash, c.first_user_id, c.first_nickname, c.first_time,
+         last_time, ",".join(c.users), len(c.users), int(c.promoted))
+        for c, last_time, _ in candidates.values()
+    ])
+    # 能由聊天记录重算的梗（包括归一化/近似合并掉的变体）先删除，再按重算结果写入
+    stale = []
+    for (text,) in conn.execute("SELECT meme_text FROM meme_dict WHERE group_id = ?", (group_id,)).fetchall():
+        key = meme_key(text)
+        if key in candidates or key in aliases:
+            stale.append((group_id, text))
+    conn.executemany("DELETE FROM meme_dict WHERE group_id = ? AND meme_text = ?", stale)
+    memes = [
+        (group_id, c.content, c.first_nickname, c.first_user_id, len(c.users) - 1, promoted_time)
+        for c, _, promoted_time in candidates.values() if c.promoted
+    ]
+    conn.executemany('''
+        INSERT INTO meme_dict
+        (group_id, meme_text, creator, creator_id, usage_count, create_time)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', memes)
+    return len(memes)
+
+
+def recompute_memes(conn, fuzzy_distance=None, source="chat_records"):
+    """按 chat_records 一遍流式扫描重建 meme_candidates / meme_dict / user_meme_stats，需在事务内调用
+
+    按群顺序扫描，内存中只保留当前群的候选。聊天记录已过期的旧梗保留在 meme_dict 中不变，
+    user_meme_stats 最后按 meme_dict 汇总，即原创者所有梗的不同引用人数之和。
+    source 可换成包含各月分区的视图。
+    """
+    stats = {"records": 0, "candidates": 0, "memes": 0}
+    conn.execute("DELETE FROM meme_candidates")
+    rows = conn.execute(f'''
+        SELECT group_id, meme_key, content, user_id, user_nickname, create_time
+        FROM {source} ORDER BY group_id, create_time, id
+    ''')
+    index = SimHashIndex(fuzzy_distance) if fuzzy_distance else None
+    current_group, candidates, aliases = None, {}, {}
+    for group_id, key, content, user_id, nickname, create_time in rows:
+        stats["records"] += 1
+        if group_id != current_group:
+            if candidates:
+                stats["memes"] += _flush_group(conn, current_group, candidates, aliases)
+                stats["candidates"] += len(candidates)
+            current_group, candidates, aliases = group_id, {}, {}
+            if index:
+                index.load_group(group_id, [])
+        # meme_key 为 NULL 的是紧凑存储中截断的正文，截断后的文字可能恰好像梗，不能参与匹配
+        if key is None or not content or not is_potential_meme(content):
+            continue
+        entry = candidates.get(aliases.get(key, key))
+        if entry is None:
+            norm = normalize_content(content)
+            # 指纹只用于近似匹配，未开启时等到第二个用户出现再算
+            value = simhash(norm) if index else None
+            match = index.find(group_id, value) if index else None
+            if match is None:
+                candidate = MemeCandidate((group_id, key), content, norm, value, user_id, nickname, create_time,
+                                          {user_id})
+                candidates[key] = [candidate, create_time, None]
+                continue
+            aliases[key] = match
+            entry = candidates[match]
+        candidate = entry[0]
+        entry[1] = create_time
+        if user_id not in candidate.users:
+            candidate.users.add(user_id)
+            if candidate.simhash is None:
+                candidate.simhash = simhash(candidate.norm)
+            if index and len(candidate.users) == 2:
+                index.add(group_id, candidate.key[1], candidate.simhash)
+            if not candidate.promoted and len(candidate.users) >= MEME_THRESHOLD:
+                candidate.promoted = True
+                entry[2] = create_time
+    if candidates:
+        stats["memes"] += _flush_group(conn, current_group, candidates, aliases)
+        stats["candidates"] += len(candidates)
+
+    conn.execute("DELETE FROM user_meme_stats")
+    conn.execute('''
+        INSERT INTO user_meme_stats (user_id, group_id, meme_count)
+        SELECT creator_id, group_id, SUM(usage_count) FROM meme_dict GROUP BY creator_id, group_id
+    ''')
+    return stats
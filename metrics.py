@@ -0,0 +1,145 @@
+# encoding:utf-8
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from common.log import logger
+
+
+class Histogram:
+    """滑动窗口直方图：保留最近 size 个样本用于分位数，累计值覆盖全部样本"""
+
+    def __init__(self, size=1024):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(len(samples) * p / 100))
+        return samples[index]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3),
+        }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """插件运行指标：按 (类别, 名称) 记录耗时直方图（毫秒），外加计数器和慢操作日志
+
+    类别为 stage（消息处理和落盘的各阶段）或 command（查询命令）。
+    记录一次只是一次 perf_counter 差值和一次加锁追加，热路径上的开销在微秒级。
+    """
+
+    def __init__(self, slow_ms=200, slow_log_size=50):
+        self.slow_ms = slow_ms  # 单次耗时达到该值时记入慢操作日志，0 表示关闭
+        self.started = time.time()
+        self._histograms = {}
+        self._counters = {}
+        self.slow = deque(maxlen=slow_log_size)  # (时间, 类别, 名称, 毫秒, 说明)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, kind, name, detail=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, name, (time.perf_counter() - start) * 1000, detail)
+
+    def observe(self, kind, name, ms, detail=None):
+        histogram = self._histograms.get((kind, name))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault((kind, name), Histogram())
+        histogram.observe(ms)
+        if self.slow_ms and ms >= self.slow_ms:
+            self.slow.append((time.strftime('%Y-%m-%d %H:%M:%S'), kind, name, round(ms, 1), detail))
+            logger.warning(f"[GroupFun] 慢操作 {kind}/{name} 耗时 {ms:.1f}ms" + (f"：{detail}" if detail else ""))
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        result = {"uptime_seconds": round(time.time() - self.started), "counters": counters}
+        for (kind, name), histogram in sorted(histograms.items()):
+            result.setdefault(kind, {})[name] = histogram.snapshot()
+        result["slow"] = list(self.slow)
+        return result
+
+    def prometheus(self, gauges=None):
+        """Prometheus 文本格式：耗时为 summary（分位数取最近的样本窗口），计数器和 gauges 原样输出"""
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+        lines = []
+        for kind in sorted({kind for kind, _ in histograms}):
+            metric = f"groupfun_{kind}_ms"
+            lines.append(f"# TYPE {metric} summary")
+            for (item_kind, name), histogram in sorted(histograms.items()):
+                if item_kind != kind:
+                    continue
+                label = f'{kind}="{_label(name)}"'
+                for quantile in (50, 99):
+                    lines.append(f'{metric}{{{label},quantile="{quantile / 100}"}} {histogram.percentile(quantile):.3f}')
+                lines.append(f"{metric}_sum{{{label}}} {histogram.total:.3f}")
+                lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE groupfun_{name}_total counter")
+            lines.append(f"groupfun_{name}_total {value}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE groupfun_{name} gauge")
+            lines.append(f"groupfun_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class PeriodicReporter:
+    """后台线程每隔 interval_seconds 调用一次 report_fn（写指标日志或 Prometheus 文本文件）"""
+
+    def __init__(self, report_fn, interval_seconds=60, name="GroupFun-metrics"):
+        self.report_fn = report_fn
+        self.interval = max(1, interval_seconds)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report_fn()
+            except Exception as e:
+                logger.error(f"[GroupFun] 输出运行指标失败: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(5)
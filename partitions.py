@@ -0,0 +1,154 @@
+# encoding:utf-8
+import os
+import re
+from datetime import datetime, timedelta
+
+from common.log import logger
+from .storage import resolved_select
+
+# chat_records 的二级索引，与 schema.py 中的定义一致；批量导入时会先删除再重建
+CHAT_RECORDS_INDEXES = {
+    "idx_chat_records_group_time_user": '''CREATE INDEX IF NOT EXISTS {schema}.idx_chat_records_group_time_user
+        ON chat_records (group_id, create_time, user_id)''',
+}
+
+# 与 schema.py 中最新版本的 chat_records 结构保持一致
+_PARTITION_DDL = [
+    '''CREATE TABLE IF NOT EXISTS {schema}.chat_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id TEXT NOT NULL,
+        user_nickname TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        content TEXT,
+        create_time TEXT NOT NULL,
+        hour_group INTEGER,
+        content_hash INTEGER,
+        meme_key INTEGER,
+        nickname_id INTEGER
+    )''',
+] + list(CHAT_RECORDS_INDEXES.values())
+
+_COLUMNS = "group_id, user_nickname, user_id, content, create_time, hour_group, content_hash, meme_key, nickname_id"
+
+_FILE_PATTERN = re.compile(r"^chat_(\d{6})\.db$")
+
+
+def month_of(create_time):
+    """'2024-05-01 12:00:00' -> '202405'"""
+    return create_time[:4] + create_time[5:7]
+
+
+def month_range(month):
+    """月份的日期区间[start, end)，可直接与 create_time 做字符串比较"""
+    start = datetime.strptime(month, '%Y%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+
+def resolved_view(conn, schemas=("main",), name="chat_records_all"):
+    """把若干库的 chat_records（已还原正文和昵称）合成一个 UNION ALL 临时视图，返回视图名"""
+    conn.execute(f"DROP VIEW IF EXISTS temp.{name}")
+    conn.execute(f"CREATE TEMP VIEW {name} AS " + " UNION ALL ".join(resolved_select(schema) for schema in schemas))
+    return name
+
+
+class ChatPartitions:
+    """按月分区的聊天记录：每月一个 SQLite 文件，放在主库旁的 chat_partitions 目录
+
+    分区文件按需 ATTACH 到当前线程的连接上，schema 名为 chat_YYYYMM。过期清理直接删除整月的文件；
+    按天汇总、梗和成就等表仍在主库。
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.directory = os.path.join(os.path.dirname(os.path.abspath(db.path)), "chat_partitions")
+
+    @staticmethod
+    def schema(month):
+        return f"chat_{month}"
+
+    def table(self, create_time):
+        return f"{self.schema(month_of(create_time))}.chat_records"
+
+    def path(self, month):
+        return os.path.join(self.directory, f"chat_{month}.db")
+
+    def months(self):
+        """已存在的分区月份，升序"""
+        months = []
+        if not os.path.isdir(self.directory):
+            return months
+        for name in os.listdir(self.directory):
+            match = _FILE_PATTERN.match(name)
+            if match:
+                months.append(match.group(1))
+        return sorted(months)
+
+    def attach(self, conn, months):
+        """把需要的月份挂到连接上（不存在则建表），并卸下其余分区；ATTACH 不能在事务内执行"""
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        wanted = {self.schema(month) for month in months}
+        for schema in attached - wanted:
+            if _FILE_PATTERN.match(schema + ".db"):
+                conn.execute(f"DETACH DATABASE {schema}")
+        for month in sorted(months):
+            schema = self.schema(month)
+            if schema in attached:
+                continue
+            os.makedirs(self.directory, exist_ok=True)
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (self.path(month),))
+            for name in ("journal_mode", "synchronous"):
+                if name in self.db.pragmas:
+                    conn.execute(f"PRAGMA {schema}.{name}={self.db.pragmas[name]}")
+            for ddl in _PARTITION_DDL:
+                conn.execute(ddl.format(schema=schema))
+            # 与主库 v10 一致，删除旧分区文件上不再使用的索引
+            conn.execute(f"DROP INDEX IF EXISTS {schema}.idx_chat_records_group_hash")
+            # v7 之前建的分区文件没有 nickname_id 列
+            if "nickname_id" not in {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(chat_records)")}:
+                conn.execute(f"ALTER TABLE {schema}.chat_records ADD COLUMN nickname_id INTEGER")
+
+    def union_view(self, conn, name="chat_records_all"):
+        """挂上全部分区，建立主库与各分区 chat_records 的 UNION ALL 临时视图，返回视图名（供离线工具全量扫描）
+
+        视图中紧凑存储的行已还原正文和昵称。
+        """
+        months = self.months()
+        self.attach(conn, months)
+        return resolved_view(conn, ["main"] + [self.schema(month) for month in months], name)
+
+    def expired(self, cutoff):
+        """整月都早于 cutoff 的分区月份"""
+        return [month for month in self.months() if month_range(month)[1] <= cutoff[:10]]
+
+    def drop(self, month):
+        """删除一个分区文件，返回释放的字节数；调用方需保证没有连接挂着该分区"""
+        freed = 0
+        for suffix in ("", "-wal", "-shm"):
+            path = self.path(month) + suffix
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        logger.info(f"[GroupFun] 删除过期分区 {month}，释放 {freed} 字节")
+        return freed
+
+    def split(self, conn):
+        """把主库 chat_records 中的记录按月搬到分区文件，每月一个事务，返回 {月份: 行数}"""
+        moved = {}
+        months = [row[0] for row in conn.execute(
+            "SELECT DISTINCT substr(create_time, 1, 4) || substr(create_time, 6, 2) FROM main.chat_records")]
+        for month in sorted(months):
+            start, end = month_range(month)
+            self.attach(conn, [month])
+            with self.db.transaction():
+                count = conn.execute(f'''
+                    INSERT INTO {self.schema(month)}.chat_records ({_COLUMNS})
+                    SELECT {_COLUMNS} FROM main.chat_records
+                    WHERE create_time >= ? AND create_time < ?
+                    ORDER BY create_time, id
+                ''', (start, end)).rowcount
+                conn.execute("DELETE FROM main.chat_records WHERE create_time >= ? AND create_time < ?",
+                             (start, end))
+            moved[month] = count
+        self.attach(conn, [])
+        return moved
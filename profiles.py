@@ -0,0 +1,44 @@
+# encoding:utf-8
+from collections import OrderedDict
+
+
+class ProfileCache:
+    """群成员当前昵称：user_profiles 表前面放一个容量为 cache_size 的内存LRU，键为 (group_id, user_id)
+
+    写入时只有昵称与缓存不同（或未缓存）的成员才写一行，且库中昵称相同时不改动；
+    排行榜展示名通过 JOIN user_profiles 一次取回。只能在写入事务内调用，事务回滚后需 clear()。
+    """
+
+    def __init__(self, cache_size=10000):
+        self.cache_size = max(1, cache_size)
+        self._cache = OrderedDict()
+
+    def save(self, conn, records):
+        """登记本批发言人的昵称，返回写库的行数"""
+        latest = {}
+        for record in records:
+            latest[(record.other_user_id, record.actual_user_id)] = (record.actual_user_nickname, record.create_time)
+        rows = []
+        for key, (nickname, create_time) in latest.items():
+            if self._cache.get(key) == nickname:
+                self._cache.move_to_end(key)
+                continue
+            rows.append(key + (nickname, create_time))
+        if rows:
+            conn.executemany('''
+                INSERT INTO user_profiles (group_id, user_id, nickname, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(group_id, user_id) DO UPDATE SET nickname = excluded.nickname, updated_at = excluded.updated_at
+                WHERE nickname != excluded.nickname
+            ''', rows)
+            for group_id, user_id, nickname, _ in rows:
+                self._remember((group_id, user_id), nickname)
+        return len(rows)
+
+    def _remember(self, key, nickname):
+        self._cache[key] = nickname
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
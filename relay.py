@@ -0,0 +1,173 @@
+# encoding:utf-8
+import hmac
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+
+from common.log import logger
+
+
+def parse_address(address):
+    """'127.0.0.1:47231' -> ('127.0.0.1', 47231)"""
+    host, _, port = str(address).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def load_token(path):
+    """读取本机各进程共享的转发令牌，文件不存在时生成一个（权限 0600，只有运行机器人的用户可读）"""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # 另一个进程可能刚创建文件还没写入，稍等再读
+        for _ in range(50):
+            with open(path, encoding="utf-8") as f:
+                token = f.read().strip()
+            if token:
+                return token
+            time.sleep(0.02)
+        raise RuntimeError(f"转发令牌文件为空: {path}")
+    token = secrets.token_hex(32)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
+
+
+class WriteRelay:
+    """单写者模式：多个机器人进程中抢先监听本地端口的一个负责全部写入，其余进程把消息转发给它
+
+    协议为每行一个 JSON 数组（一批消息），写者把这批消息放进自己的写入队列后回一个空行作为确认。
+    每个连接的第一行是共享令牌，不匹配的连接直接关闭，本机其他用户或进程无法往库里注入消息。
+    写者退出后，下一个转发失败的进程会尝试接管端口成为新的写者；接管失败则抛出异常由写入队列重试。
+    """
+
+    def __init__(self, address, on_records, record_type, token, timeout=5.0):
+        self.host, self.port = parse_address(address)
+        self.on_records = on_records  # 写者收到一批转发的消息后调用
+        self.record_type = record_type
+        self.token = token.encode("utf-8")
+        self.timeout = timeout
+        self._server = None
+        self._client = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._conns = set()
+        self.received = 0
+        self.forwarded = 0
+
+    @property
+    def is_owner(self):
+        return self._server is not None
+
+    def start(self):
+        if self._try_own():
+            logger.info(f"[GroupFun] 单写者模式：本进程负责写入，监听 {self.host}:{self.port}")
+        else:
+            logger.info(f"[GroupFun] 单写者模式：消息转发到 {self.host}:{self.port}")
+
+    def _try_own(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Windows 的 SO_REUSEADDR 允许多个进程同时监听同一端口，必须用独占模式；
+        # 其他系统上 SO_REUSEADDR 只是允许在旧写者的 TIME_WAIT 连接未消失时立即接管
+        if hasattr(socket, "SO_EXCLUSIVEADDRUSE"):
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind((self.host, self.port))
+            server.listen(16)
+        except OSError:
+            server.close()
+            return False
+        self._server = server
+        threading.Thread(target=self._accept, name="GroupFun-relay", daemon=True).start()
+        return True
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), name="GroupFun-relay-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        self._conns.add(conn)
+        try:
+            with conn, conn.makefile("rb") as reader:
+                conn.settimeout(self.timeout)
+                if not hmac.compare_digest(reader.readline(1024).rstrip(b"\n"), self.token):
+                    logger.warning("[GroupFun] 拒绝令牌不匹配的转发连接")
+                    return
+                conn.settimeout(None)
+                for line in reader:
+                    if self._closed:
+                        # 正在退出，不再接收；发送方收不到确认会接管或重试
+                        break
+                    try:
+                        records = [self.record_type(*fields) for fields in json.loads(line)]
+                        self.on_records(records)
+                    except Exception as e:
+                        # 不回确认，发送方会重试
+                        logger.error(f"[GroupFun] 处理转发的消息失败: {e}", exc_info=True)
+                        break
+                    self.received += len(records)
+                    try:
+                        conn.sendall(b"\n")
+                    except OSError:
+                        break
+        except OSError:
+            # 发送方断开（连接被重置）或 close() 关闭了连接，结束该连接即可
+            pass
+        finally:
+            self._conns.discard(conn)
+
+    def _disconnect(self):
+        for closeable in (self._reader, self._client):
+            if closeable is not None:
+                try:
+                    closeable.close()
+                except OSError:
+                    pass
+        self._client = self._reader = None
+
+    def send(self, records):
+        """把一批消息转发给写者并等待确认；写者已退出且本进程接管成功时返回 False，由调用方自己写入"""
+        payload = (json.dumps([list(record) for record in records], ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                if self._client is None:
+                    self._client = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                    self._reader = self._client.makefile("rb")
+                    self._client.sendall(self.token + b"\n")
+                self._client.sendall(payload)
+                if not self._reader.readline():
+                    raise ConnectionError("写者进程已断开")
+            except OSError:
+                self._disconnect()
+                if not self._closed and self._try_own():
+                    logger.warning(f"[GroupFun] 写者进程已退出，本进程接管写入 {self.host}:{self.port}")
+                    return False
+                raise
+        self.forwarded += len(records)
+        return True
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            self._disconnect()
+        # 先 shutdown 才能唤醒阻塞在 accept/recv 上的线程并立即释放端口，供其他进程接管
+        for sock in [self._server] + list(self._conns):
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def stats(self):
+        return {"owner": self.is_owner, "received": self.received, "forwarded": self.forwarded}
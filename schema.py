@@ -0,0 +1,274 @@
+# encoding:utf-8
+from common.log import logger
+from .memes import content_hash, meme_key, recompute_memes
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _v1_base_tables(conn):
+    """基础表结构，兼容没有版本号的旧库"""
+    # 聊天记录表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT NOT NULL,
+            user_nickname TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            content TEXT,
+            create_time TEXT NOT NULL,
+            hour_group INTEGER
+        )''')
+    # 早期版本没有 hour_group 列，原地补上而不是删库重建
+    if "hour_group" not in _columns(conn, "chat_records"):
+        conn.execute("ALTER TABLE chat_records ADD COLUMN hour_group INTEGER")
+        conn.execute("UPDATE chat_records SET hour_group = CAST(substr(create_time, 12, 2) AS INTEGER)")
+
+    # 梗词典表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS meme_dict (
+            group_id TEXT NOT NULL,
+            meme_text TEXT NOT NULL,
+            creator TEXT NOT NULL,
+            creator_id TEXT NOT NULL,
+            usage_count INTEGER DEFAULT 1,
+            create_time TEXT NOT NULL,
+            PRIMARY KEY (group_id, meme_text)
+        )''')
+
+    # 用户梗数统计表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_meme_stats (
+            user_id TEXT NOT NULL,
+            group_id TEXT NOT NULL,
+            meme_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, group_id)
+        )''')
+
+    # 成就表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_achievements (
+            user_id TEXT NOT NULL,
+            group_id TEXT NOT NULL,
+            achievement_id TEXT NOT NULL,
+            unlock_time TEXT NOT NULL,
+            PRIMARY KEY (user_id, group_id, achievement_id)
+        )''')
+
+    # 时段统计表
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS hour_stats (
+            user_id TEXT NOT NULL,
+            group_id TEXT NOT NULL,
+            hour_group INTEGER NOT NULL,
+            count INTEGER DEFAULT 0,
+            date TEXT NOT NULL,
+            PRIMARY KEY (user_id, group_id, hour_group, date)
+        )''')
+
+
+def _v2_chat_record_indexes(conn):
+    """chat_records 增加内容哈希列和覆盖索引"""
+    if "content_hash" not in _columns(conn, "chat_records"):
+        conn.execute("ALTER TABLE chat_records ADD COLUMN content_hash INTEGER")
+    conn.create_function("gf_content_hash", 1, content_hash)
+    conn.execute("UPDATE chat_records SET content_hash = gf_content_hash(content) WHERE content_hash IS NULL")
+    # 按群+时间范围统计发言（水王），索引带上 user_id 可直接覆盖 GROUP BY/过滤
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_records_group_time_user
+        ON chat_records (group_id, create_time, user_id)''')
+    # 按群+内容查找重复消息（三人成梗），带上 create_time 使查找原创者无需排序
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_records_group_hash
+        ON chat_records (group_id, content_hash, create_time)''')
+
+
+def _v3_daily_user_counts(conn):
+    """按天汇总的发言计数表，并从 chat_records 回填"""
+    # 主键以 (group_id, date) 开头，既能点查单人当日计数，也能按日期区间汇总排行
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_user_counts (
+            group_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            user_nickname TEXT,
+            PRIMARY KEY (group_id, date, user_id)
+        ) WITHOUT ROWID''')
+    conn.execute('''
+        INSERT OR REPLACE INTO daily_user_counts (group_id, date, user_id, count, user_nickname)
+        SELECT group_id, substr(create_time, 1, 10), user_id, COUNT(*), MAX(user_nickname)
+        FROM chat_records
+        GROUP BY group_id, substr(create_time, 1, 10), user_id''')
+
+
+def _v4_meme_candidates(conn):
+    """三人成梗候选表（由 v5 按归一化键重建并回填）"""
+    # v5 会删表重建并全量重算，这里只建表，不再回填一遍
+    # user_ids 为逗号分隔的不同用户ID
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS meme_candidates (
+            group_id TEXT NOT NULL,
+            content_hash INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            first_user_id TEXT NOT NULL,
+            first_nickname TEXT,
+            first_time TEXT NOT NULL,
+            last_time TEXT NOT NULL,
+            user_ids TEXT NOT NULL,
+            user_count INTEGER DEFAULT 1,
+            promoted INTEGER DEFAULT 0,
+            PRIMARY KEY (group_id, content_hash)
+        )''')
+
+
+def _v5_normalized_meme_keys(conn):
+    """梗按归一化内容匹配：chat_records 增加 meme_key，梗候选按新键重建"""
+    if "meme_key" not in _columns(conn, "chat_records"):
+        conn.execute("ALTER TABLE chat_records ADD COLUMN meme_key INTEGER")
+    conn.create_function("gf_meme_key", 1, meme_key)
+    conn.execute("UPDATE chat_records SET meme_key = gf_meme_key(content) WHERE meme_key IS NULL")
+    conn.execute("DROP TABLE IF EXISTS meme_candidates")
+    # norm_text 用于校验哈希碰撞，simhash 用于可选的近似匹配
+    conn.execute('''
+        CREATE TABLE meme_candidates (
+            group_id TEXT NOT NULL,
+            meme_key INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            norm_text TEXT NOT NULL,
+            simhash INTEGER,
+            first_user_id TEXT NOT NULL,
+            first_nickname TEXT,
+            first_time TEXT NOT NULL,
+            last_time TEXT NOT NULL,
+            user_ids TEXT NOT NULL,
+            user_count INTEGER DEFAULT 1,
+            promoted INTEGER DEFAULT 0,
+            PRIMARY KEY (group_id, meme_key)
+        )''')
+    recompute_memes(conn)
+
+
+def _v6_hour_stats_group_index(conn):
+    """hour_stats 增加按群+日期的覆盖索引，用于活跃时段统计"""
+    # 主键以 user_id 开头，按群汇总需要另建以 group_id 开头的索引，带上 hour_group/count 免回表
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_hour_stats_group_date
+        ON hour_stats (group_id, date, hour_group, count)''')
+
+
+def _v7_compact_storage(conn):
+    """紧凑存储：正文和昵称的去重表，chat_records 增加昵称 id 列"""
+    # content_hash 直接作主键（即 rowid），不另建索引；last_day 为公历序数日，用于清理不再被引用的正文
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_contents (
+            content_hash INTEGER PRIMARY KEY,
+            content TEXT,
+            last_day INTEGER NOT NULL
+        )''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_nicknames (
+            id INTEGER PRIMARY KEY,
+            nickname TEXT NOT NULL UNIQUE
+        )''')
+    if "nickname_id" not in _columns(conn, "chat_records"):
+        conn.execute("ALTER TABLE chat_records ADD COLUMN nickname_id INTEGER")
+
+
+
+def _v8_user_profiles(conn):
+    """群成员当前昵称表，并从按天汇总回填"""
+    # updated_at 为设置该昵称的消息时间，补导入的旧消息不会覆盖较新的昵称
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            group_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            nickname TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (group_id, user_id)
+        ) WITHOUT ROWID''')
+    # MAX(date) 让昵称取该用户最近一天的值
+    conn.execute('''
+        INSERT OR IGNORE INTO user_profiles (group_id, user_id, nickname, updated_at)
+        SELECT group_id, user_id, user_nickname, MAX(date)
+        FROM daily_user_counts
+        WHERE user_nickname IS NOT NULL
+        GROUP BY group_id, user_id''')
+
+
+def _v9_meme_candidates_prune_index(conn):
+    """meme_candidates 增加 (promoted, last_time) 索引，用于清理过期候选"""
+    # 后台清理按 promoted = 0 AND last_time < ? 分批删除，没有索引时每批都要全表扫描
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_meme_candidates_promoted_time
+        ON meme_candidates (promoted, last_time)''')
+
+
+def _v10_drop_chat_records_group_hash(conn):
+    """删除 chat_records 上不再使用的 (group_id, content_hash, create_time) 索引"""
+    # 梗检测读 meme_candidates，没有查询再用这个索引，每次插入却都要维护它；按月分区的文件在挂载时删除
+    conn.execute("DROP INDEX IF EXISTS idx_chat_records_group_hash")
+
+
+def _v11_chat_contents_last_day_index(conn):
+    """chat_contents 增加 last_day 索引，用于清理不再被引用的正文"""
+    # 清理按 last_day < ? 分批删除，没有索引时每批（包括最后一批空批次）都要全表扫描
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_contents_last_day
+        ON chat_contents (last_day)''')
+
+
+def _v12_rollup_date_indexes(conn):
+    """hour_stats、daily_user_counts 增加以 date 开头的索引，用于成就引擎跨天时加载当天计数"""
+    # 只含 date（及主键/rowid），count 的增量更新不需要维护这两个索引
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_user_counts_date
+        ON daily_user_counts (date)''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_hour_stats_date
+        ON hour_stats (date)''')
+
+
+def _v13_import_progress(conn):
+    """批量导入的汇总起点表，导入中断后重新执行时据此补齐汇总"""
+    # month 为分区月份 YYYYMM，不分区时为空串；start_id 为首次导入前该表的最大 id
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_progress (
+            month TEXT PRIMARY KEY,
+            start_id INTEGER NOT NULL
+        )''')
+
+# (目标版本号, 迁移函数)，只能追加，不能修改已发布的步骤
+MIGRATIONS = [
+    (1, _v1_base_tables),
+    (2, _v2_chat_record_indexes),
+    (3, _v3_daily_user_counts),
+    (4, _v4_meme_candidates),
+    (5, _v5_normalized_meme_keys),
+    (6, _v6_hour_stats_group_index),
+    (7, _v7_compact_storage),
+    (8, _v8_user_profiles),
+    (9, _v9_meme_candidates_prune_index),
+    (10, _v10_drop_chat_records_group_hash),
+    (11, _v11_chat_contents_last_day_index),
+    (12, _v12_rollup_date_indexes),
+    (13, _v13_import_progress),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """按 PRAGMA user_version 依次执行未应用的迁移，需在事务内调用"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"数据库版本({version})高于插件支持的版本({SCHEMA_VERSION})")
+    for target, step in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"[GroupFun] 数据库迁移 v{version} -> v{target}: {step.__doc__}")
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {target}")
+        version = target
+    return version
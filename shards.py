@@ -0,0 +1,94 @@
+# encoding:utf-8
+import os
+import re
+import zlib
+
+from .achievements import AchievementEngine
+from .db import Database
+from .partitions import ChatPartitions
+
+_SHARD_DIR = re.compile(r"^shard_(\d+)$")
+
+
+def shard_of(group_id, count):
+    """群所在的分片序号。用 crc32 而不是 hash()：字符串的 hash() 每个进程随机，多进程和重启后会不一致"""
+    if count <= 1:
+        return 0
+    return zlib.crc32(str(group_id).encode("utf-8")) % count
+
+
+def shard_path(path, index):
+    """第0片沿用原库文件，其余分片放在同目录的 shard_N/ 下（按月分区目录随库文件各自独立）"""
+    if index == 0:
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(path)), f"shard_{index}", os.path.basename(path))
+
+
+def existing_shards(path):
+    """磁盘上已有库文件的分片序号，升序"""
+    indexes = [0] if os.path.exists(path) else []
+    directory = os.path.dirname(os.path.abspath(path))
+    for name in os.listdir(directory):
+        match = _SHARD_DIR.match(name)
+        if match and os.path.exists(os.path.join(directory, name, os.path.basename(path))):
+            indexes.append(int(match.group(1)))
+    return sorted(indexes)
+
+
+class Shard:
+    """一个分片：库连接、可选的按月分区和该分片的成就状态"""
+
+    def __init__(self, index, db, partitions=None, achievements=None):
+        self.index = index
+        self.db = db
+        self.partitions = partitions
+        self.achievements = achievements
+
+
+class ShardRouter:
+    """按 group_id 的稳定哈希把每个群固定到 N 个库文件之一，读写都经这里路由
+
+    一个群的全部数据（聊天记录、汇总、梗、成就）都在同一分片，查询无需跨库。
+    count 为 1 时只有原来的 fun_center.db，与不分片完全相同。
+    """
+
+    def __init__(self, path, count=1, pragmas=None, partition_by_month=False, achievements=None, read_pool_size=4):
+        if count < 1:
+            raise ValueError(f"分片数必须是正整数: {count}")
+        self.path = path
+        self.shards = []
+        for index in range(count):
+            db_path = shard_path(path, index)
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            db = Database(db_path, pragmas, read_pool_size=read_pool_size)
+            self.shards.append(Shard(
+                index,
+                db,
+                ChatPartitions(db) if partition_by_month else None,
+                AchievementEngine(achievements) if achievements is not None else None,
+            ))
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def shard(self, group_id):
+        return self.shards[shard_of(group_id, len(self.shards))]
+
+    def db(self, group_id):
+        return self.shard(group_id).db
+
+    def route(self, records, group_of=lambda record: record.other_user_id):
+        """把一批记录按分片分组，返回 [(shard, records)]，组内保持原顺序"""
+        if len(self.shards) == 1:
+            return [(self.shards[0], records)] if records else []
+        routed = {}
+        for record in records:
+            routed.setdefault(shard_of(group_of(record), len(self.shards)), []).append(record)
+        return [(self.shards[index], routed[index]) for index in sorted(routed)]
+
+    def close_all(self):
+        for shard in self.shards:
+            shard.db.close_all()
@@ -0,0 +1,80 @@
+# encoding:utf-8
+from datetime import datetime
+
+from .memes import is_potential_meme
+
+
+def day_number(date):
+    """'2024-05-01' -> 公历序数日，chat_contents.last_day 用整数保存以节省空间"""
+    return datetime.strptime(date[:10], '%Y-%m-%d').toordinal()
+
+
+def resolved_select(schema="main"):
+    """读取一张 chat_records 的 SELECT，紧凑存储的行从 chat_contents/chat_nicknames 还原正文和昵称
+
+    列与原始 chat_records 相同，供全量扫描（重算梗、分片搬迁）使用；普通行原样返回。
+    正文截断后留在行内的紧凑行不是完整原文，meme_key 返回 NULL，重算梗时跳过。
+    """
+    return f'''
+        SELECT r.id, r.group_id, COALESCE(n.nickname, r.user_nickname) AS user_nickname, r.user_id,
+               COALESCE(r.content, c.content) AS content, r.create_time, r.hour_group, r.content_hash,
+               CASE WHEN r.nickname_id IS NOT NULL AND r.content IS NOT NULL THEN NULL ELSE r.meme_key END AS meme_key
+        FROM {schema}.chat_records r
+        LEFT JOIN main.chat_nicknames n ON n.id = r.nickname_id
+        LEFT JOIN main.chat_contents c ON r.content IS NULL AND c.content_hash = r.content_hash'''
+
+
+class ContentStore:
+    """紧凑存储：昵称去重存入 chat_nicknames，chat_records 中只留整数 id（user_nickname 为空串）
+
+    可能成梗的消息会反复出现且离线重算梗需要原文，按 content_hash 去重存入 chat_contents，行内 content 为 NULL；
+    其余消息几乎不重复，截断到 max_content_length 个字后留在行内，0 表示不保存正文。
+    昵称 id 和当天已登记的正文哈希按分片缓存在内存中，事务回滚后需 clear()。
+    """
+
+    def __init__(self, max_content_length=50, cache_size=10000):
+        self.max_content_length = max_content_length
+        self.cache_size = cache_size
+        self._nicknames = {}  # (分片序号, 昵称) -> chat_nicknames.id
+        self._contents = {}  # (分片序号, content_hash) -> 已登记的 last_day
+
+    def clear(self):
+        self._nicknames = {}
+        self._contents = {}
+
+    def content(self, text):
+        """(行内保存的正文, 登记到 chat_contents 的正文)"""
+        if is_potential_meme(text):
+            return None, text
+        return text[:self.max_content_length] or None, None
+
+    def nickname_ids(self, conn, shard_index, nicknames):
+        """{昵称: id}，未缓存的昵称批量登记后逐个查回 id（昵称很少变化，绝大多数批次直接命中缓存）"""
+        missing = [name for name in nicknames if (shard_index, name) not in self._nicknames]
+        if missing:
+            if len(self._nicknames) + len(missing) > self.cache_size:
+                self._nicknames = {}
+                missing = list(nicknames)
+            conn.executemany("INSERT OR IGNORE INTO chat_nicknames (nickname) VALUES (?)",
+                             [(name,) for name in missing])
+            for name in missing:
+                self._nicknames[(shard_index, name)] = conn.execute(
+                    "SELECT id FROM chat_nicknames WHERE nickname = ?", (name,)).fetchone()[0]
+        return {name: self._nicknames[(shard_index, name)] for name in nicknames}
+
+    def save_contents(self, conn, shard_index, contents, date):
+        """登记本批的正文 {content_hash: 正文}，已有的只刷新最后使用日，供过期清理判断；当天登记过的跳过"""
+        day = day_number(date)
+        rows = [(hashed, text, day) for hashed, text in contents.items()
+                if self._contents.get((shard_index, hashed)) != day]
+        if not rows:
+            return
+        if len(self._contents) + len(rows) > self.cache_size:
+            self._contents = {}
+        conn.executemany('''
+            INSERT INTO chat_contents (content_hash, content, last_day) VALUES (?, ?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET last_day = excluded.last_day
+            WHERE last_day < excluded.last_day
+        ''', rows)
+        for hashed, _, _ in rows:
+            self._contents[(shard_index, hashed)] = day
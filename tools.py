@@ -0,0 +1,259 @@
+# encoding:utf-8
+"""GroupFun 离线维护工具。先停止机器人，再在机器人根目录执行：
+
+    python -m plugins.GroupFun.tools [--db 数据库路径] <命令> [参数]
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from .achievements import AchievementEngine, load_achievements
+from .compactor import Compactor
+from .db import Database
+from .importer import BULK_PRAGMAS, HistoryImporter, iter_records, iter_rows
+from .memes import recompute_memes
+from .partitions import ChatPartitions
+from .schema import migrate
+from .shards import ShardRouter, existing_shards, shard_of
+from .storage import resolved_select
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(PLUGIN_DIR, "fun_center.db")
+
+# 按群存放、分片时随群一起搬迁的表
+SHARDED_TABLES = ("chat_records", "hour_stats", "daily_user_counts", "meme_candidates", "meme_dict",
+                  "user_meme_stats", "user_achievements", "user_profiles")
+
+
+def load_plugin_config(path=None):
+    """读取插件配置，默认依次尝试插件目录下的 config.json 和 config.json.template"""
+    candidates = [path] if path else [os.path.join(PLUGIN_DIR, name) for name in ("config.json", "config.json.template")]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            with open(candidate, encoding="utf-8") as f:
+                return json.load(f)
+    return {}
+
+
+def cmd_recompute_memes(args):
+    """从聊天记录重建梗候选、梗词典和用户梗数"""
+    db = Database(args.db)
+    start = time.perf_counter()
+    with db.transaction() as conn:
+        migrate(conn)
+    # 主库和各月分区一起扫描；ATTACH 需在事务外执行
+    source = ChatPartitions(db).union_view(db.connection())
+    with db.transaction() as conn:
+        stats = recompute_memes(conn, args.fuzzy_distance, source)
+        # 重算后按当前规则补发达到条件的成就
+        engine = AchievementEngine(load_achievements(load_plugin_config()))
+        unlock_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for (group_id,) in conn.execute("SELECT DISTINCT group_id FROM user_meme_stats").fetchall():
+            engine.evaluate_group(conn, group_id, unlock_time)
+    db.close_all()
+    print(f"扫描 {stats['records']} 条记录，重建 {stats['candidates']} 个梗候选、{stats['memes']} 个梗，"
+          f"耗时 {time.perf_counter() - start:.2f}s")
+
+
+def cmd_compact(args):
+    """按保留天数清理过期数据"""
+    db = Database(args.db)
+    with db.transaction() as conn:
+        migrate(conn)
+    partitions = ChatPartitions(db)
+    report = Compactor(db, args.days, batch_size=args.batch_size, pause_ms=0,
+                       partitions=partitions if partitions.months() else None).run_once(dry_run=args.dry_run)
+    db.close_all()
+    print(report)
+
+
+def cmd_split_partitions(args):
+    """把主库中的聊天记录按月拆分到分区文件（启用 partition_by_month 前执行一次）"""
+    db = Database(args.db)
+    start = time.perf_counter()
+    with db.transaction() as conn:
+        migrate(conn)
+    conn = db.connection()
+    moved = ChatPartitions(db).split(conn)
+    for month, count in moved.items():
+        print(f"{month}: {count} 条")
+    if args.vacuum:
+        conn.execute("VACUUM")
+    db.close_all()
+    print(f"共拆分 {sum(moved.values())} 条记录到 {len(moved)} 个分区，耗时 {time.perf_counter() - start:.2f}s")
+
+
+def cmd_reevaluate_achievements(args):
+    """按当前成就规则用历史数据重新判断，补发达到条件的成就"""
+    engine = AchievementEngine(load_achievements(load_plugin_config(args.config)))
+    db = Database(args.db)
+    unlock_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with db.transaction() as conn:
+        migrate(conn)
+        if args.group:
+            groups = [args.group]
+        else:
+            groups = [row[0] for row in conn.execute(
+                "SELECT group_id FROM daily_user_counts UNION SELECT group_id FROM user_meme_stats")]
+        for group_id in groups:
+            granted = engine.evaluate_group(conn, group_id, unlock_time)
+            print(f"{group_id}: " + (", ".join(f"{k} +{v}" for k, v in granted.items() if v) or "无新增"))
+    db.close_all()
+
+
+def cmd_import(args):
+    """从导出的聊天记录（JSONL/CSV）批量导入历史数据，结束后重建统计、梗和成就"""
+    config = load_plugin_config(args.config)
+    # 按配置的 shards 把每个群写入它所在的分片，每个分片一个导入器
+    shards = ShardRouter(args.db, config.get("shards", 1), BULK_PRAGMAS,
+                         partition_by_month=config.get("partition_by_month", False),
+                         achievements=load_achievements(config))
+    start = time.perf_counter()
+    for shard in shards:
+        with shard.db.transaction() as conn:
+            migrate(conn)
+    importers = [HistoryImporter(shard.db, batch_size=args.batch_size, partitions=shard.partitions,
+                                 engine=shard.achievements) for shard in shards]
+    stats = {"imported": 0, "skipped": 0, "duplicates": 0, "groups": 0, "memes": 0}
+    try:
+        for path in args.files:
+            for record in iter_records(iter_rows(path, args.format), args.group, stats):
+                importers[shard_of(record[0], len(importers))].add(record)
+        for importer in importers:
+            importer.flush()
+    finally:
+        for importer in importers:
+            importer.restore_indexes()
+    loaded = time.perf_counter() - start
+    for importer in importers:
+        importer.rebuild(config.get("meme_fuzzy_distance", 0))
+        for key in ("imported", "duplicates", "groups", "memes"):
+            stats[key] += importer.stats[key]
+    shards.close_all()
+    print(f"导入 {stats['imported']} 条（跳过 {stats['skipped']} 条，库中已有 {stats['duplicates']} 条），"
+          f"耗时 {loaded:.2f}s，{stats['imported'] / max(loaded, 1e-9):.0f} 条/秒；重建 {stats['groups']} 个群的统计、"
+          f"{stats['memes']} 个梗，总耗时 {time.perf_counter() - start:.2f}s")
+
+
+def _move_groups(conn, source, group_ids):
+    """把若干群在 source 表中的行搬到已挂载为 target 的库的同名表，与删除源行在同一事务中"""
+    schema, table = source.split(".")
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})") if row[1] != "id"]
+    rows = source
+    if table == "chat_records":
+        # 紧凑存储的 chat_nicknames id 和 chat_contents 只在本分片有效，还原成普通行再搬
+        rows = f"({resolved_select(schema)})"
+        columns = [column for column in columns if column != "nickname_id"]
+    columns = ", ".join(columns)
+    moved = 0
+    for group_id in group_ids:
+        moved += conn.execute(f"INSERT OR IGNORE INTO target.{table} ({columns}) "
+                              f"SELECT {columns} FROM {rows} WHERE group_id = ?", (group_id,)).rowcount
+        conn.execute(f"DELETE FROM {source} WHERE group_id = ?", (group_id,))
+    return moved
+
+
+def _by_target(group_ids, source, count):
+    """不属于 source 分片的群按目标分片分组"""
+    targets = defaultdict(list)
+    for group_id in sorted(group_ids):
+        target = shard_of(group_id, count)
+        if target != source:
+            targets[target].append(group_id)
+    return targets
+
+
+def cmd_reshard(args):
+    """修改 shards 后按新的分片数搬迁各群的数据（聊天记录、汇总、梗和成就）"""
+    count = args.shards or load_plugin_config(args.config).get("shards", 1)
+    total = max([count] + [index + 1 for index in existing_shards(args.db)])
+    shards = ShardRouter(args.db, total, partition_by_month=True)
+    start = time.perf_counter()
+    for shard in shards:
+        with shard.db.transaction() as conn:
+            migrate(conn)
+    moved = defaultdict(int)
+    for source in shards:
+        conn = source.db.connection()
+        groups = set()
+        for table in SHARDED_TABLES:
+            groups.update(row[0] for row in conn.execute(f"SELECT DISTINCT group_id FROM {table}"))
+        for target, group_ids in _by_target(groups, source.index, count).items():
+            conn.execute("ATTACH DATABASE ? AS target", (shards.shards[target].db.path,))
+            try:
+                with source.db.transaction():
+                    for table in SHARDED_TABLES:
+                        moved[table] += _move_groups(conn, f"main.{table}", group_ids)
+            finally:
+                conn.execute("DETACH DATABASE target")
+        # 按月分区的聊天记录搬到目标分片同月份的分区文件
+        for month in source.partitions.months():
+            source.partitions.attach(conn, [month])
+            schema = source.partitions.schema(month)
+            groups = [row[0] for row in conn.execute(f"SELECT DISTINCT group_id FROM {schema}.chat_records")]
+            for target, group_ids in _by_target(groups, source.index, count).items():
+                partitions = shards.shards[target].partitions
+                partitions.attach(shards.shards[target].db.connection(), [month])
+                conn.execute("ATTACH DATABASE ? AS target", (partitions.path(month),))
+                try:
+                    with source.db.transaction():
+                        moved["chat_records"] += _move_groups(conn, f"{schema}.chat_records", group_ids)
+                finally:
+                    conn.execute("DETACH DATABASE target")
+            source.partitions.attach(conn, [])
+    shards.close_all()
+    for table in SHARDED_TABLES:
+        print(f"{table}: 搬迁 {moved[table]} 行")
+    if total > count:
+        print(f"分片 {count}..{total - 1} 已清空，确认无误后可删除对应的 shard_N 目录")
+    print(f"共 {count} 个分片，耗时 {time.perf_counter() - start:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m plugins.GroupFun.tools", description="GroupFun 离线维护工具")
+    parser.add_argument("--db", default=DEFAULT_DB, help="数据库路径，默认为插件目录下的 fun_center.db")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    recompute = commands.add_parser("recompute-memes", help=cmd_recompute_memes.__doc__)
+    recompute.add_argument("--fuzzy-distance", type=int, default=0,
+                           help="SimHash 近似合并的最大汉明距离，0 表示只做归一化匹配")
+    recompute.set_defaults(func=cmd_recompute_memes)
+
+    compact = commands.add_parser("compact", help=cmd_compact.__doc__)
+    compact.add_argument("--days", type=int, default=30, help="保留天数，默认30")
+    compact.add_argument("--batch-size", type=int, default=5000, help="每批删除行数")
+    compact.add_argument("--dry-run", action="store_true", help="只统计将删除的行数，不实际删除")
+    compact.set_defaults(func=cmd_compact)
+
+    split = commands.add_parser("split-partitions", help=cmd_split_partitions.__doc__)
+    split.add_argument("--vacuum", action="store_true", help="拆分后 VACUUM 主库以缩小文件")
+    split.set_defaults(func=cmd_split_partitions)
+
+    reevaluate = commands.add_parser("reevaluate-achievements", help=cmd_reevaluate_achievements.__doc__)
+    reevaluate.add_argument("--group", help="只处理指定群，默认全部群")
+    reevaluate.add_argument("--config", help="插件配置文件路径，默认读取插件目录下的 config.json")
+    reevaluate.set_defaults(func=cmd_reevaluate_achievements)
+
+    importer = commands.add_parser("import", help=cmd_import.__doc__)
+    importer.add_argument("files", nargs="+", help="导出文件，按扩展名识别 .csv，其余按 JSONL 读取")
+    importer.add_argument("--format", choices=("jsonl", "csv"), help="强制指定文件格式")
+    importer.add_argument("--group", help="所有记录都导入到该群（导出文件按群分开时使用）")
+    importer.add_argument("--batch-size", type=int, default=50000, help="每个事务写入的行数")
+    importer.add_argument("--config", help="插件配置文件路径，默认读取插件目录下的 config.json")
+    importer.set_defaults(func=cmd_import)
+
+    reshard = commands.add_parser("reshard", help=cmd_reshard.__doc__)
+    reshard.add_argument("--shards", type=int, help="新的分片数，默认读取配置中的 shards")
+    reshard.add_argument("--config", help="插件配置文件路径，默认读取插件目录下的 config.json")
+    reshard.set_defaults(func=cmd_reshard)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# encoding:utf-8
+import threading
+import time
+from collections import deque
+
+from common.log import logger
+from .metrics import Histogram
+
+
+class PartialFlushError(Exception):
+    """flush_fn 只写入了一部分（如多个分片中有的已提交），remaining 为仍需重试的记录"""
+
+    def __init__(self, remaining):
+        super().__init__(f"{len(remaining)} 条未写入")
+        self.remaining = remaining
+
+
+class WriteBehindQueue:
+    """后台批量写入队列：攒够 batch_size 条或等待超过 flush_interval_ms 即交给 flush_fn 落盘"""
+
+    # block: 队列满时生产者最多等待 block_timeout_ms；drop_new: 丢弃新消息；drop_old: 丢弃最旧的消息
+    OVERFLOW_POLICIES = ("block", "drop_new", "drop_old")
+
+    def __init__(self, flush_fn, batch_size=200, flush_interval_ms=200, max_size=10000,
+                 overflow="drop_old", block_timeout_ms=1000, retries=2, name="GroupFun-writer"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"未知的队列溢出策略: {overflow}")
+        self.flush_fn = flush_fn
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_size = max(self.batch_size, max_size)
+        self.overflow = overflow
+        self.block_timeout = block_timeout_ms / 1000
+        self.retries = retries
+        self.name = name
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+        # 指标
+        self.flush_latency = Histogram()  # 毫秒
+        self.batch_sizes = Histogram()
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """入队，返回是否成功；队列满时按溢出策略处理"""
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return False
+            if len(self._items) >= self.max_size:
+                if self.overflow == "drop_new":
+                    self.dropped += 1
+                    return False
+                if self.overflow == "drop_old":
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._items) >= self.max_size and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if len(self._items) >= self.max_size or self._closed:
+                        self.dropped += 1
+                        return False
+            self._items.append(item)
+            self.enqueued += 1
+            depth = len(self._items)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if depth >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._items) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed and not self._items:
+                    return
+                count = min(len(self._items), self.batch_size)
+                batch = [self._items.popleft() for _ in range(count)]
+                # 唤醒 block 策略下等待空位的生产者
+                self._cond.notify_all()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        total = len(batch)
+        for attempt in range(self.retries + 1):
+            try:
+                self.flush_fn(batch)
+                break
+            except Exception as e:
+                if isinstance(e, PartialFlushError):
+                    # 已提交的部分不再重试，避免重复写入
+                    batch = e.remaining
+                if attempt == self.retries:
+                    self.failed += len(batch)
+                    self.flushed += total - len(batch)
+                    logger.error(f"[GroupFun] 批量写入失败，丢弃 {len(batch)} 条: {e}", exc_info=True)
+                    return
+                logger.warning(f"[GroupFun] 批量写入失败，第{attempt + 1}次重试: {e}")
+                time.sleep(0.05 * (attempt + 1))
+        self.flush_latency.observe((time.perf_counter() - start) * 1000)
+        self.batch_sizes.observe(total)
+        self.flushed += total
+
+    def close(self, timeout=10):
+        """停止接收新数据并把队列中剩余数据全部落盘"""
+        with self._cond:
+            if self._closed and not (self._thread and self._thread.is_alive()):
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"[GroupFun] 写入队列未能在{timeout}秒内清空，剩余 {len(self._items)} 条")
+                return
+        logger.info(f"[GroupFun] 写入队列已关闭: {self.stats()}")
+
+    def stats(self):
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batch_size": self.batch_sizes.snapshot(),
+            "flush_latency_ms": self.flush_latency.snapshot(),
+        }